@@ -0,0 +1,114 @@
+""" Audio size benchmark for the WaveNet encodings.
+
+Synthesizes the same sentences (by default, the ones of the recorded Reverso page under fixtures/)
+with every encoding and sample rate asked for, and reports the average bytes per clip and what the
+media of a deck of --cards cards would weigh. Unlike bench_parsers.py, this calls the Text-to-Speech
+API (bypassing the audio cache), so it needs WaveNet credentials. Usage:
+
+    python benchmarks/bench_audio_encodings.py [--sentences 20] [--cards 10000] [--sample-rates 24000 16000] [--json results.json]
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "reverso_scraping"))
+
+
+def fixture_sentences(count):
+    """ Returns up to count target-language sentences of the recorded Reverso page """
+
+    from page_parser import parse_page_cards
+    from str_utils import strip_markup
+
+    with open(os.path.join(FIXTURES, "reverso_page.html"), "rb") as f:
+        cardInfos = parse_page_cards(f.read(), "fr-FR")
+    return [strip_markup(targetSentence) for targetSentence, _ in cardInfos][:count]
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def measure(sentences, language, encoding, sampleRate):
+    """ Synthesizes every sentence with an encoding and returns the sizes of the clips, in bytes """
+
+    from google.cloud import texttospeech
+    from wavenet import client, get_voices, make_audio_config
+
+    audioConfig = make_audio_config(encoding, sampleRate)
+    voices = sorted(get_voices(language))
+    sizes = list()
+    for sentence in sentences:
+        # Same voice for a sentence whatever the encoding, as generate_audio_random() picks it
+        selectedVoice = random.Random(sentence).choice(voices)
+        voice = texttospeech.types.VoiceSelectionParams(
+            name=selectedVoice,
+            language_code=selectedVoice[0:5],
+            ssml_gender=texttospeech.enums.SsmlVoiceGender.SSML_VOICE_GENDER_UNSPECIFIED,
+        )
+        response = client.synthesize_speech(texttospeech.types.SynthesisInput(text=sentence), voice, audioConfig)
+        sizes.append(len(response.audio_content))
+    return sizes
+
+
+def main():
+    from wavenet import AUDIO_EXTENSIONS
+
+    parser = argparse.ArgumentParser(description="Audio size benchmark for the WaveNet encodings")
+    parser.add_argument("--sentences", type=int, default=20, help="sentences synthesized per encoding")
+    parser.add_argument("--sentences-file", help="read sentences from this file (one per line) instead of the fixture")
+    parser.add_argument("--language", default="fr-FR")
+    parser.add_argument("--cards", type=int, default=10000, help="deck size used to project its media size")
+    parser.add_argument("--encodings", nargs="*", choices=AUDIO_EXTENSIONS.keys(), default=list(AUDIO_EXTENSIONS))
+    parser.add_argument(
+        "--sample-rates", nargs="*", type=int, default=[0], help="sample rates to try, in Hz (0: the voice's own)"
+    )
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.sentences_file:
+        with open(args.sentences_file, encoding="utf-8") as f:
+            sentences = [line.strip() for line in f if line.strip()][: args.sentences]
+    else:
+        sentences = fixture_sentences(args.sentences)
+
+    results = dict()
+    for encoding in args.encodings:
+        for sampleRate in args.sample_rates:
+            sizes = measure(sentences, args.language, encoding, sampleRate)
+            bytesPerClip = sum(sizes) / len(sizes)
+            results[f"{encoding}@{sampleRate or 'default'}"] = {
+                "encoding": encoding,
+                "extension": AUDIO_EXTENSIONS[encoding],
+                "sample_rate_hertz": sampleRate or None,
+                "clips": len(sizes),
+                "bytes_per_clip": bytesPerClip,
+                "deck_media_bytes": bytesPerClip * args.cards,
+            }
+
+    print(f"{len(sentences)} sentences per encoding, deck of {args.cards} cards")
+    print(f"{'encoding':<22}{'bytes/clip':>12}{'deck media':>14}{'vs LINEAR16':>13}")
+    linear = [result["bytes_per_clip"] for result in results.values() if result["encoding"] == "LINEAR16"]
+    for name, result in results.items():
+        ratio = f"{result['bytes_per_clip'] / max(linear):.2f}x" if linear else "-"
+        print(
+            f"{name:<22}{result['bytes_per_clip']:>12.0f}{format_size(result['deck_media_bytes']):>14}{ratio:>13}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
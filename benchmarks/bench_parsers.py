@@ -0,0 +1,287 @@
+""" Offline parse-throughput benchmarks for every scraper.
+
+Runs the parsing and formatting hot paths against the recorded HTML pages under fixtures/,
+with network and audio (TTS/downloads) stubbed out, and reports pages/sec, sentences/sec
+and peak memory for each one. Usage:
+
+    python benchmarks/bench_parsers.py [--iterations N] [--only reverso_page ...] [--json results.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import types
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "reverso_scraping"))
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def load_scraper(name, relativePath):
+    """ Imports a scraper's script under a unique module name (they are all called scrap.py) """
+
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relativePath))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+def fake_get(content):
+    """ Stands in for cached_get, always answering with content """
+
+    return lambda url, headers=None, **kwargs: FakeResponse(content)
+
+
+def fake_download_files(urls):
+    """ Stands in for download_files, returning the names the files would be saved as """
+
+    return [url.split("/")[-1] for url in urls]
+
+
+class MemorySink:
+    """ Stands in for the export sink, formatting rows in memory and counting them """
+
+    def __init__(self, separator="\t"):
+        self.separator = separator
+        self.output = io.StringIO()
+        self.rows = 0
+
+    def write_cards(self, rows):
+        for row in rows:
+            self.output.write(self.separator.join(map(str, row)) + "\n")
+            self.rows += 1
+
+    def take_rows(self):
+        """ Returns how many rows were written since the last call """
+
+        rows, self.rows = self.rows, 0
+        self.output = io.StringIO()
+        return rows
+
+
+def install_memory_sink(module):
+    sink = MemorySink()
+    module.get_sink = lambda directory, name, separator="\t": sink
+    # Every iteration parses the same page: keep its sentences instead of skipping them as duplicates
+    module.claim_sentence = lambda sentence, source: True
+    module.claim_cards = lambda cards, source: list(cards)
+    return sink
+
+
+# Each benchmark returns a function that processes one page and returns how many sentences it produced
+
+
+def bench_reverso_page():
+    from page_parser import parse_page_cards
+    from str_utils import strip_markup
+    from common.audio_format import audio_filename
+
+    content = read_fixture("reverso_page.html")
+    sink = MemorySink()
+
+    def run():
+        cardInfos = parse_page_cards(content, "fr-FR")
+        sink.write_cards(
+            [targetSentence, nativeSentence, f"[sound:{audio_filename(strip_markup(targetSentence))}]", "targetLanguage_reverso"]
+            for targetSentence, nativeSentence in cardInfos
+        )
+        return sink.take_rows()
+
+    return run
+
+
+def bench_reverso_crawl_top():
+    import crawl
+
+    ranking = read_fixture("reverso_top_ranking.html")
+    topList = read_fixture("reverso_top_list.html")
+
+    def run():
+        crawl.cached_get = fake_get(ranking)
+        rankingURLs = crawl.crawl_top("https://context.reverso.net/traducao/index/frances-portugues/p.html", ranking=True)
+        crawl.cached_get = fake_get(topList)
+        names = crawl.crawl_top("https://context.reverso.net/traducao/index/frances-portugues/p-1-400.html", onlyNames=True)
+        return len(rankingURLs) + len(names)
+
+    return run
+
+
+def bench_influx_page():
+    influx = load_scraper("influx_scrap", "influx_scraping/scrap.py")
+    influx.cached_get = fake_get(read_fixture("influx_post.html"))
+    influx.download_files = fake_download_files
+    sink = install_memory_sink(influx)
+
+    def run():
+        influx.scrap_page("https://blog.influx.com.br/take-it-easy")
+        return sink.take_rows()
+
+    return run
+
+
+def bench_frances_fluente_post():
+    francesFluente = load_scraper("frances_fluente_scrap", "frances_fluente_scraping/scrap.py")
+    francesFluente.cached_get = fake_get(read_fixture("frances_fluente_post.html"))
+    francesFluente.download_files = fake_download_files
+    sink = install_memory_sink(francesFluente)
+
+    def run():
+        francesFluente.post_to_card("https://www.francesfluente.com/avoir-la-flemme/")
+        return sink.take_rows()
+
+    return run
+
+
+def bench_frances_fluente_crawl():
+    francesFluente = load_scraper("frances_fluente_crawl", "frances_fluente_scraping/scrap.py")
+    loadmore = read_fixture("frances_fluente_loadmore.html")
+    nPages = 20
+
+    class FakeSession:
+        """ admin-ajax.php answering nPages pages of posts, then empty pages """
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+        def post(self, url, data=None, **kwargs):
+            return FakeResponse(loadmore if data["page"] <= nPages else b"")
+
+    francesFluente.requests = types.SimpleNamespace(Session=FakeSession)
+
+    def run():
+        francesFluente.crawl_page("https://francesfluente.com")
+        with open("posts_urls.txt", encoding="utf8") as f:
+            return sum(1 for _ in f)
+
+    return run
+
+
+def bench_mairo_vergara_post():
+    mairoVergara = load_scraper("mairo_vergara_scrap", "mairo_vergara_scraping/scrap.py")
+    mairoVergara.cached_get = fake_get(read_fixture("mairo_vergara_post.html"))
+    mairoVergara.download_files = fake_download_files
+    sink = install_memory_sink(mairoVergara)
+
+    def run():
+        mairoVergara.post_to_card("https://www.mairovergara.com/bite-the-bullet/")
+        return sink.take_rows()
+
+    return run
+
+
+def bench_mairo_vergara_long_post():
+    """ The Mairo Vergara post with its body repeated 20 times, to track how extraction scales with post length """
+
+    mairoVergara = load_scraper("mairo_vergara_long_scrap", "mairo_vergara_scraping/scrap.py")
+    content = read_fixture("mairo_vergara_post.html").decode("utf-8")
+    bodyStart = content.index('<div class="td-post-content">') + len('<div class="td-post-content">')
+    bodyEnd = content.index("</div>", bodyStart)
+    content = content[:bodyStart] + content[bodyStart:bodyEnd] * 20 + content[bodyEnd:]
+
+    mairoVergara.cached_get = fake_get(content.encode("utf-8"))
+    mairoVergara.download_files = fake_download_files
+    sink = install_memory_sink(mairoVergara)
+
+    def run():
+        mairoVergara.post_to_card("https://www.mairovergara.com/bite-the-bullet/")
+        return sink.take_rows()
+
+    return run
+
+
+BENCHMARKS = {
+    "reverso_page": bench_reverso_page,
+    "reverso_crawl_top": bench_reverso_crawl_top,
+    "influx_page": bench_influx_page,
+    "frances_fluente_post": bench_frances_fluente_post,
+    "frances_fluente_crawl": bench_frances_fluente_crawl,
+    "mairo_vergara_post": bench_mairo_vergara_post,
+    "mairo_vergara_long_post": bench_mairo_vergara_long_post,
+}
+
+
+def measure(run, iterations):
+    """ Times `iterations` calls of run, then does one extra call under tracemalloc for peak memory """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        sentences = run()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "seconds": elapsed,
+        "pages_per_sec": iterations / elapsed,
+        "sentences_per_page": sentences,
+        "sentences_per_sec": sentences * iterations / elapsed,
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline parse-throughput benchmarks for the scrapers")
+    parser.add_argument("--iterations", type=int, default=50, help="pages processed per benchmark")
+    parser.add_argument("--only", nargs="*", choices=BENCHMARKS.keys(), help="benchmarks to run")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as workDir:
+        for name in args.only or BENCHMARKS:
+            # Scrapers write to csv/, audios/ and other paths relative to the working directory
+            benchDir = os.path.join(workDir, name)
+            os.makedirs(os.path.join(benchDir, "csv"))
+            os.makedirs(os.path.join(benchDir, "audios"))
+            os.chdir(benchDir)
+
+            # Keep the scrapers' progress messages out of the report
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                run = BENCHMARKS[name]()
+                results[name] = measure(run, args.iterations)
+            if results[name]["sentences_per_page"] <= 0:
+                # A parser that stopped matching its page would otherwise look very fast
+                raise RuntimeError(f"{name} produced no sentences: its parser no longer matches the fixture")
+        os.chdir(ROOT)
+
+    print(f"{'benchmark':<26}{'pages/s':>10}{'sentences/s':>14}{'sentences/page':>16}{'peak KiB':>11}")
+    for name, result in results.items():
+        print(
+            f"{name:<26}{result['pages_per_sec']:>10.1f}{result['sentences_per_sec']:>14.1f}"
+            f"{result['sentences_per_page']:>16}{result['peak_memory_kib']:>11.0f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
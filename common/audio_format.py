@@ -0,0 +1,24 @@
+import os
+
+# Audio encodings WaveNet can be asked for, with the extension of their files
+AUDIO_EXTENSIONS = {"MP3": "mp3", "OGG_OPUS": "ogg", "LINEAR16": "wav"}
+
+# Encoding of generated audios: MP3 unless WAVENET_AUDIO_ENCODING says otherwise
+AUDIO_ENCODING = os.getenv("WAVENET_AUDIO_ENCODING", "MP3").upper()
+if AUDIO_ENCODING not in AUDIO_EXTENSIONS:
+    raise ValueError(
+        f"Unsupported audio encoding {AUDIO_ENCODING}, expected one of {', '.join(AUDIO_EXTENSIONS)}."
+    )
+AUDIO_EXTENSION = AUDIO_EXTENSIONS[AUDIO_ENCODING]
+
+
+def get_modified_path(originalPath):
+    """Modifies the sentence's string so it can be used as a path"""
+
+    return "".join(c for c in originalPath if c.isalpha())
+
+
+def audio_filename(sentence):
+    """Returns the name of a sentence's audio file, with the extension of the configured encoding"""
+
+    return f"{get_modified_path(sentence)}.{AUDIO_EXTENSION}"
@@ -0,0 +1,319 @@
+import os
+import re
+import html
+import struct
+import sqlite3
+import hashlib
+import threading
+
+from .metrics import metrics
+
+# Any HTML tag, as left by the formatting functions (<b>, <u>...)
+TAG_REGEX = re.compile(r"<[^>]*>")
+# Runs of characters that are not letters or digits
+NON_WORD_REGEX = re.compile(r"[\W_]+")
+
+# Mersenne prime used by the MinHash permutations
+MINHASH_PRIME = (1 << 61) - 1
+
+
+def normalize_sentence(sentence):
+    """ Returns the text a sentence is de-duplicated on: markup stripped (like BeautifulSoup(...).text),
+    entities unescaped, case folded, punctuation and extra whitespace removed """
+
+    text = html.unescape(TAG_REGEX.sub("", sentence)).casefold()
+    return NON_WORD_REGEX.sub(" ", text).strip()
+
+
+class MinHasher:
+    """ MinHash signatures of a text's character shingles, split into LSH bands.
+
+    Two texts share a band with a probability that grows quickly with their Jaccard similarity,
+    so near duplicates are found by only comparing texts that share at least one band.
+    """
+
+    def __init__(self, numPerm=64, bands=16, shingleSize=5):
+        self.numPerm = numPerm
+        self.bands = bands
+        self.rows = numPerm // bands
+        self.shingleSize = shingleSize
+
+        # Fixed seeds, so signatures stay comparable across runs
+        seeds = hashlib.shake_128(b"minhash").digest(16 * numPerm)
+        self._permutations = [
+            (
+                int.from_bytes(seeds[16 * i : 16 * i + 8], "little") % (MINHASH_PRIME - 1) + 1,
+                int.from_bytes(seeds[16 * i + 8 : 16 * i + 16], "little") % MINHASH_PRIME,
+            )
+            for i in range(numPerm)
+        ]
+
+    def signature(self, text):
+        n = self.shingleSize
+        shingles = {text[i : i + n] for i in range(max(1, len(text) - n + 1))}
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            for shingle in shingles
+        ]
+        return [min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in self._permutations]
+
+    def band_keys(self, signature):
+        """ Returns one key per band: the band's index followed by a digest of its rows """
+
+        return [
+            band.to_bytes(1, "little")
+            + hashlib.blake2b(
+                struct.pack(f"<{self.rows}Q", *signature[band * self.rows : (band + 1) * self.rows]),
+                digest_size=8,
+            ).digest()
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(signature, otherSignature):
+        """ Estimated Jaccard similarity of the texts behind two signatures """
+
+        return sum(a == b for a, b in zip(signature, otherSignature)) / len(signature)
+
+
+class SentenceIndex:
+    """ Persistent index of the sentences every scraper already kept, across sources and runs.
+
+    Scrapers claim() a sentence before synthesizing its audio and exporting its card; only the
+    first claim of a normalized sentence succeeds, so duplicates are never voiced or written.
+    With nearDuplicates=True, sentences whose MinHash similarity to a kept one is at least
+    `threshold` are rejected too.
+
+    A claim stays pending until its card reaches an export shard (confirm(), called by the export
+    sinks). Scrapers release() their claims when voicing or exporting fails, and pending claims
+    of processes that died are dropped when the index is next opened, so the card can be scraped
+    again instead of being skipped as a duplicate forever.
+
+    The index is a SQLite database: claims are atomic transactions, so it can be shared by the
+    threads and processes of a single run (multiprocessing pools) as well as across runs.
+    """
+
+    def __init__(self, path, nearDuplicates=False, threshold=0.8, numPerm=64, bands=16):
+        self.path = path
+        self.nearDuplicates = nearDuplicates
+        self.threshold = threshold
+        self.minHasher = MinHasher(numPerm, bands) if nearDuplicates else None
+
+        self.kept = 0
+        self.duplicates = 0
+        self.nearDuplicatesFound = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread and process, opened on first use
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sentences (normalized TEXT PRIMARY KEY, sentence TEXT, source TEXT, signature BLOB)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS bands (band BLOB, normalized TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS bands_band ON bands (band)")
+            connection.execute("CREATE TABLE IF NOT EXISTS pending (normalized TEXT PRIMARY KEY, pid INTEGER)")
+            self._drop_stale_claims(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _delete_claims(connection, where, parameters):
+        """ Deletes the sentences (and bands) of the pending claims matching `where` """
+
+        for table in ("bands", "sentences"):
+            connection.execute(
+                f"DELETE FROM {table} WHERE normalized IN (SELECT normalized FROM pending WHERE {where})", parameters
+            )
+        connection.execute(f"DELETE FROM pending WHERE {where}", parameters)
+
+    def _drop_stale_claims(self, connection):
+        """ Drops the claims left pending by processes that died before exporting their cards """
+
+        pids = [row[0] for row in connection.execute("SELECT DISTINCT pid FROM pending")]
+        stalePids = [pid for pid in pids if not _process_alive(pid)]
+        if not stalePids:
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for pid in stalePids:
+                self._delete_claims(connection, "pid = ?", (pid,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __contains__(self, sentence):
+        row = self._connection().execute(
+            "SELECT 1 FROM sentences WHERE normalized = ?", (normalize_sentence(sentence),)
+        ).fetchone()
+        return row is not None
+
+    def _find_near_duplicate(self, connection, signature, bandKeys):
+        candidates = {
+            row[0]
+            for bandKey in bandKeys
+            for row in connection.execute(
+                "SELECT signature FROM bands JOIN sentences USING (normalized) WHERE band = ?", (bandKey,)
+            )
+        }
+        for candidate in candidates:
+            otherSignature = struct.unpack(f"<{len(signature)}Q", candidate)
+            if MinHasher.similarity(signature, otherSignature) >= self.threshold:
+                return True
+        return False
+
+    def claim(self, sentence, source):
+        """ Records sentence as kept by source. Returns False if it (or, with nearDuplicates, a
+        sentence close enough to it) was already kept, in which case it must be skipped """
+
+        normalized = normalize_sentence(sentence)
+        if not normalized:
+            return True
+
+        connection = self._connection()
+        signature = bandKeys = packedSignature = None
+        if self.minHasher is not None:
+            signature = self.minHasher.signature(normalized)
+            bandKeys = self.minHasher.band_keys(signature)
+            packedSignature = struct.pack(f"<{len(signature)}Q", *signature)
+
+        # Check and insert in a single write transaction, so concurrent claims can't both succeed
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO sentences VALUES (?, ?, ?, ?)",
+                (normalized, sentence, source, packedSignature),
+            ).rowcount
+            if not inserted:
+                connection.execute("COMMIT")
+                self._count("duplicates")
+                metrics.count("dedup_duplicates")
+                return False
+
+            if signature is not None:
+                if self._find_near_duplicate(connection, signature, bandKeys):
+                    connection.execute("ROLLBACK")
+                    self._count("nearDuplicatesFound")
+                    metrics.count("dedup_near_duplicates")
+                    return False
+                connection.executemany(
+                    "INSERT INTO bands VALUES (?, ?)", [(bandKey, normalized) for bandKey in bandKeys]
+                )
+            connection.execute("INSERT OR REPLACE INTO pending VALUES (?, ?)", (normalized, os.getpid()))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        self._count("kept")
+        metrics.count("dedup_kept")
+        return True
+
+    def _update_claims(self, sentences, update):
+        """ Runs update(connection, (normalized sentence, pid)) for every sentence, in one transaction """
+
+        normalizedSentences = [(normalize_sentence(sentence), os.getpid()) for sentence in sentences]
+        if not normalizedSentences:
+            return
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for parameters in normalizedSentences:
+                update(connection, parameters)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def confirm(self, sentences):
+        """ Marks this process's claims of sentences as final, once their cards are exported """
+
+        self._update_claims(
+            sentences,
+            lambda connection, parameters: connection.execute(
+                "DELETE FROM pending WHERE normalized = ? AND pid = ?", parameters
+            ),
+        )
+
+    def release(self, sentences):
+        """ Cancels this process's pending claims of sentences, whose cards could not be exported,
+        so they can be claimed again. Sentences claimed by other processes are left as they are """
+
+        self._update_claims(
+            sentences,
+            lambda connection, parameters: self._delete_claims(connection, "normalized = ? AND pid = ?", parameters),
+        )
+
+    def stats(self):
+        """ Returns this process's kept/duplicate/near-duplicate counters """
+
+        with self._lock:
+            return {
+                "kept": self.kept,
+                "duplicates": self.duplicates,
+                "near_duplicates": self.nearDuplicatesFound,
+            }
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Alive, but owned by another user
+        return True
+    return True
+
+
+# Index shared by every scraper, whatever directory they run from (~/.cache/sentence-mining/).
+# Configure it with environment variables: SENTENCE_INDEX_PATH, SENTENCE_INDEX_NEAR_DUPLICATES=1
+# to also skip near duplicates, and SENTENCE_INDEX_THRESHOLD for their minimum similarity
+sentence_index = SentenceIndex(
+    os.getenv(
+        "SENTENCE_INDEX_PATH",
+        os.path.join(os.path.expanduser("~"), ".cache", "sentence-mining", "sentence_index.sqlite3"),
+    ),
+    nearDuplicates=os.getenv("SENTENCE_INDEX_NEAR_DUPLICATES", "0") == "1",
+    threshold=float(os.getenv("SENTENCE_INDEX_THRESHOLD", 0.8)),
+)
+
+
+def claim_sentence(sentence, source):
+    """ Claims sentence in the shared index. Returns False if it is a duplicate and must be skipped """
+
+    return sentence_index.claim(sentence, source)
+
+
+def claim_cards(cards, source):
+    """ Claims the sentences of cards (sequences starting with their sentence). Returns the cards that aren't duplicates """
+
+    return [card for card in cards if claim_sentence(card[0], source)]
+
+
+def confirm_sentences(sentences):
+    """ Makes this process's claims of sentences final, once their cards reached an export shard """
+
+    sentence_index.confirm(sentences)
+
+
+def release_sentences(sentences):
+    """ Cancels this process's claims of sentences whose cards could not be exported """
+
+    sentence_index.release(sentences)
@@ -0,0 +1,212 @@
+import os
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .json_journal import JournaledJSON
+from .metrics import metrics
+
+
+class Downloader:
+    """ Downloads files (the scrapers' audios) into a directory, in parallel, over one pooled session.
+
+    A file that is already in the directory is skipped when its size matches the server's
+    Content-Length, or when the server's ETag is the one recorded when it was downloaded
+    (kept in `<directory>/.downloads.json`). Files are written to `<name>.part` and renamed
+    once complete, so an interrupted download never leaves a truncated audio behind; the next
+    run resumes the .part file with a Range request, only if the server confirms (If-Range) that the
+    file is still the one the .part file was started from (its ETag or Last-Modified, kept in
+    `<name>.part.validator`). A .part file without a validator is downloaded again from the start.
+    """
+
+    def __init__(self, directory="audios", workers=8, poolSize=32, chunkSize=64 * 1024, timeout=60):
+        self.directory = directory
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self.timeout = timeout
+
+        # One pooled, keep-alive session, large enough to be shared by worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.downloaded = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        # One lock per local path being downloaded, with the number of threads using it, so URLs
+        # sharing a filename are never downloaded at the same time
+        self._pathLocks = dict()
+        self._etags = None
+
+    def _etag_store(self):
+        # Opened on first use, so importing this module doesn't create any folder
+        with self._lock:
+            if self._etags is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._etags = JournaledJSON(
+                    os.path.join(self.directory, ".downloads.json"), batchSize=1, compactEvery=1000
+                )
+            return self._etags
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        metrics.count(f"download_{counter}")
+
+    def _is_up_to_date(self, url, path, etags):
+        """ Checks, with a HEAD request, whether the local copy of url can be kept """
+
+        try:
+            head = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+        except requests.RequestException:
+            # Can't tell: keep what we have rather than failing the card
+            return True
+        if head.status_code != 200:
+            return True
+
+        etag = head.headers.get("ETag")
+        if etag and etags.get(url) == etag:
+            return True
+        contentLength = head.headers.get("Content-Length")
+        return contentLength is not None and int(contentLength) == os.path.getsize(path)
+
+    @contextlib.contextmanager
+    def _locked_path(self, path):
+        with self._lock:
+            entry = self._pathLocks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            # Forget the lock once no download uses it anymore
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._pathLocks[path]
+
+    def download(self, url):
+        """ Downloads url into the directory, unless it is already there. Returns the local filename """
+
+        url = url.strip()
+        localFilename = url.split("/")[-1]
+        path = os.path.join(self.directory, localFilename)
+
+        # Two downloads to the same path would share (and corrupt) its .part file
+        with self._locked_path(path):
+            self._download(url, path)
+        return localFilename
+
+    def _download(self, url, path):
+        partPath = f"{path}.part"
+        etags = self._etag_store()
+
+        if os.path.exists(path) and self._is_up_to_date(url, path, etags):
+            self._count("skipped")
+            return
+
+        # Resume a previous partial download, if the file didn't change since. Without a validator
+        # (ETag or Last-Modified) recorded when the .part file was started, there is no way to tell
+        validatorPath = f"{partPath}.validator"
+        headers = dict()
+        offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+        if offset and os.path.exists(validatorPath):
+            with open(validatorPath, "r", encoding="utf8") as f:
+                headers["If-Range"] = f.read()
+            headers["Range"] = f"bytes={offset}-"
+        else:
+            offset = 0
+
+        with metrics.stage("download"), self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as r:
+            # 416: the .part file was already complete
+            if not (offset and r.status_code == 416):
+                r.raise_for_status()
+                resuming = r.status_code == 206
+                if resuming:
+                    self._count("resumed")
+                else:
+                    self._save_validator(validatorPath, r.headers)
+                with open(partPath, "ab" if resuming else "wb") as f:
+                    for chunk in r.iter_content(self.chunkSize):
+                        f.write(chunk)
+                        metrics.count("download_bytes", len(chunk))
+                if r.headers.get("ETag"):
+                    etags.set(url, r.headers["ETag"])
+
+        os.replace(partPath, path)
+        if os.path.exists(validatorPath):
+            os.remove(validatorPath)
+        self._count("downloaded")
+
+    @staticmethod
+    def _save_validator(validatorPath, headers):
+        """ Records what a new .part file is a copy of. Weak ETags can't be used with If-Range """
+
+        etag = headers.get("ETag")
+        validator = etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
+        if validator:
+            with open(validatorPath, "w", encoding="utf8") as f:
+                f.write(validator)
+        elif os.path.exists(validatorPath):
+            os.remove(validatorPath)
+
+    def _try_download(self, url):
+        try:
+            return self.download(url)
+        except (requests.RequestException, OSError) as e:
+            print(f"Failed downloading {url}: {e}")
+            self._count("failed")
+            return None
+
+    def download_all(self, urls):
+        """ Downloads every URL in parallel. Returns the local filenames, in the same order as urls,
+        with None for the URLs that couldn't be downloaded (one bad URL doesn't fail the others) """
+
+        urls = list(urls)
+        if len(urls) <= 1 or self.workers <= 1:
+            return [self._try_download(url) for url in urls]
+
+        with ThreadPoolExecutor(min(self.workers, len(urls))) as executor:
+            return list(executor.map(self._try_download, urls))
+
+    def stats(self):
+        """ Returns the downloader's downloaded/resumed/skipped/failed counters """
+
+        with self._lock:
+            return {
+                "downloaded": self.downloaded,
+                "resumed": self.resumed,
+                "skipped": self.skipped,
+                "failed": self.failed,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._etags is not None:
+                self._etags.close()
+                self._etags = None
+
+
+# Downloader shared by every scraper, saving to audios/. Set AUDIO_DOWNLOAD_WORKERS to change its pool size
+downloader = Downloader("audios", workers=int(os.getenv("AUDIO_DOWNLOAD_WORKERS", 8)))
+
+
+def download_file(url):
+    """ Downloads url to the audios folder through the shared downloader. Returns the local filename """
+
+    return downloader.download(url)
+
+
+def download_files(urls):
+    """ Downloads every URL to the audios folder in parallel. Returns the local filenames, in order,
+    with None for the URLs that failed """
+
+    return downloader.download_all(urls)
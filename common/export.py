@@ -0,0 +1,119 @@
+import os
+import glob
+import atexit
+import hashlib
+import threading
+import multiprocessing.util
+
+from .metrics import metrics
+from .dedup import confirm_sentences
+
+
+class ExportSink:
+    """ Buffered writer collecting every scraped card of a source into a few shard files.
+
+    Each process appends to its own shard (`<directory>/shards/<name>-<pid>.txt`), so
+    concurrent processes never write to the same file, and threads share the sink through
+    a lock. Rows are buffered and written `bufferSize` at a time; merge_shards() then
+    streams every shard into the final Anki import file.
+    """
+
+    def __init__(self, directory, name, separator="\t", bufferSize=200):
+        self.directory = directory
+        self.name = name
+        self.separator = separator
+        self.bufferSize = bufferSize
+        self._buffer = list()
+        self._lock = threading.Lock()
+        self._file = None
+
+        self.shardsDirectory = os.path.join(directory, "shards")
+        os.makedirs(self.shardsDirectory, exist_ok=True)
+
+    def write_cards(self, rows):
+        """ Buffers rows (lists of fields) for writing """
+
+        lines = [self.separator.join(map(str, row)) + "\n" for row in rows]
+        with self._lock:
+            self._buffer.extend(lines)
+            if len(self._buffer) >= self.bufferSize:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            shardPath = os.path.join(self.shardsDirectory, f"{self.name}-{os.getpid()}.txt")
+            self._file = open(shardPath, "a", encoding="utf-8")
+
+        text = "".join(self._buffer)
+        with metrics.stage("csv_write"):
+            self._file.write(text)
+            self._file.flush()
+        metrics.count("csv_rows", len(self._buffer))
+        metrics.count("csv_bytes", len(text.encode("utf-8")))
+        # The cards are in the shard now: their sentences (first field) are kept for good
+        confirm_sentences(line.split(self.separator, 1)[0] for line in self._buffer)
+        self._buffer.clear()
+
+    def flush(self):
+        """ Writes buffered rows to the shard """
+
+        with self._lock:
+            self._write_buffer()
+
+    def close(self):
+        with self._lock:
+            self._write_buffer()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_sinks = dict()
+_sinksLock = threading.Lock()
+
+
+def get_sink(directory, name, separator="\t"):
+    """ Returns this process's sink for a source, creating it on first use.
+    Sinks are flushed when the process exits, including multiprocessing workers """
+
+    with _sinksLock:
+        key = (directory, name, os.getpid())
+        if key not in _sinks:
+            sink = ExportSink(directory, name, separator)
+            atexit.register(sink.close)
+            multiprocessing.util.Finalize(sink, sink.close, exitpriority=10)
+            _sinks[key] = sink
+        return _sinks[key]
+
+
+def merge_shards(directory, name, outputPath=None, separator="\t", removeShards=False):
+    """ Streams every shard of a source into a single Anki import file, skipping cards whose
+    first field (the sentence) was already written. Returns the number of cards written """
+
+    if outputPath is None:
+        outputPath = os.path.join(directory, f"{name}_anki.txt")
+
+    # Keep short digests instead of whole sentences, so memory stays low on big crawls
+    seen = set()
+    written = 0
+    shardPaths = sorted(glob.glob(os.path.join(directory, "shards", f"{name}-*.txt")))
+    with open(outputPath, "w", encoding="utf-8") as output:
+        for shardPath in shardPaths:
+            with open(shardPath, "r", encoding="utf-8") as shard:
+                for line in shard:
+                    sentence = line.split(separator, 1)[0]
+                    digest = hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest()
+                    if digest in seen:
+                        continue
+                    seen.add(digest)
+                    output.write(line)
+                    written += 1
+
+    if removeShards:
+        for shardPath in shardPaths:
+            os.remove(shardPath)
+
+    print(f"Merged {len(shardPaths)} shards into {outputPath} ({written} cards).")
+    return written
@@ -0,0 +1,72 @@
+import re
+import functools
+
+from .metrics import metrics
+
+
+def sub(pattern, replacement):
+    """ Rule replacing every match of a regex. The pattern is compiled once, when the rule is created """
+
+    return functools.partial(re.compile(pattern).sub, replacement)
+
+
+def replace(old, new):
+    """ Rule replacing a literal substring (much cheaper than a regex) """
+
+    return lambda sentence: sentence.replace(old, new)
+
+
+def strip():
+    """ Rule removing leading and trailing whitespace """
+
+    return str.strip
+
+
+class Formatter:
+    """ A site's sentence formatting rules, applied in order.
+
+    Rules are built once with sub(), replace() and strip(); lists of rules (like the shared
+    ones below) are flattened, so they can be mixed with site-specific rules.
+    """
+
+    def __init__(self, *rules):
+        self._rules = list()
+        for rule in rules:
+            if isinstance(rule, list):
+                self._rules.extend(rule)
+            else:
+                self._rules.append(rule)
+
+    def format(self, sentence):
+        """ Returns the formatted sentence """
+
+        for rule in self._rules:
+            sentence = rule(sentence)
+        return sentence
+
+    def format_all(self, sentences):
+        """ Returns a list with every sentence formatted """
+
+        rules = self._rules
+        formattedSentences = list()
+        with metrics.stage("format"):
+            for sentence in sentences:
+                for rule in rules:
+                    sentence = rule(sentence)
+                formattedSentences.append(sentence)
+        return formattedSentences
+
+
+# Rules shared by several scrapers
+
+# Replace <strong> tags with bold and underline
+STRONG_TO_BOLD_UNDERLINE = [
+    sub(r"<strong>\s*", "<b><u>"),
+    sub(r"(\W*)\s*<\/strong>", r"</u></b>\1"),
+    sub(r"(<\/u><\/b>)(\w+)", r"\1 \2"),
+]
+
+# Add full stop if necessary. A sentence can't end both in a word and in </u></b>,
+# so a single alternation does the same as one regex for each case
+ADD_FULL_STOP = [sub(r"(\w+|<\/u><\/b>)\Z", r"\1.")]
+ADD_FULL_STOP_IGNORING_WHITESPACE = [sub(r"(\w+|<\/u><\/b>)\s*\Z", r"\1.")]
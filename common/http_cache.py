@@ -0,0 +1,204 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+
+
+class CachedResponse:
+    """ Minimal stand-in for requests.Response, as returned by HTTPCache.get() """
+
+    def __init__(self, url, status_code, content, headers=None, fromCache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.fromCache = fromCache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+
+class HTTPCache:
+    """ On-disk cache for GET requests.
+
+    Bodies are stored gzip-compressed, next to a small JSON file with their ETag/Last-Modified.
+    Entries younger than `ttl` seconds are served without touching the network; older ones are
+    revalidated with a conditional GET. In `offline` mode the network is never used, and a
+    missing entry is reported as a 504, like an "only-if-cached" request.
+    """
+
+    def __init__(self, cacheDir, ttl=24 * 60 * 60, offline=False, poolSize=32):
+        self.cacheDir = cacheDir
+        self.ttl = ttl
+        self.offline = offline
+
+        # One pooled, keep-alive session, large enough to be shared by worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def _entry_paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        basePath = os.path.join(self.cacheDir, key)
+        return f"{basePath}.json", f"{basePath}.gz"
+
+    def _load(self, url):
+        metaPath, bodyPath = self._entry_paths(url)
+        try:
+            with open(metaPath, "r", encoding="utf8") as f:
+                meta = json.load(f)
+            with gzip.open(bodyPath, "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return None, None
+
+        return meta, body
+
+    def _save(self, url, meta, body=None):
+        metaPath, bodyPath = self._entry_paths(url)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+        # Write to temporary files and rename, so readers never see partial entries
+        if body is not None:
+            with gzip.open(bodyPath + suffix, "wb") as f:
+                f.write(body)
+            os.replace(bodyPath + suffix, bodyPath)
+        with open(metaPath + suffix, "w", encoding="utf8") as f:
+            json.dump(meta, f)
+        os.replace(metaPath + suffix, metaPath)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        metrics.count(f"http_cache_{counter}")
+
+    def _lookup(self, url, headers):
+        """ Returns (response, meta, body, requestHeaders). response is set when the cache can
+        answer without the network; otherwise requestHeaders revalidate the stale entry, if any """
+
+        meta, body = self._load(url)
+
+        if meta is not None and (self.offline or time.time() - meta["fetched_at"] < self.ttl):
+            self._count("hits")
+            return CachedResponse(url, 200, body, meta["headers"], fromCache=True), meta, body, None
+        if self.offline:
+            self._count("misses")
+            print(f"{url} is not cached and offline mode is on.")
+            return CachedResponse(url, 504, b""), meta, body, None
+
+        # Revalidate stale entries instead of downloading them again
+        requestHeaders = dict(headers or {})
+        if meta is not None:
+            if meta["headers"].get("ETag"):
+                requestHeaders["If-None-Match"] = meta["headers"]["ETag"]
+            if meta["headers"].get("Last-Modified"):
+                requestHeaders["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        return None, meta, body, requestHeaders
+
+    def _record(self, url, meta, body, statusCode, content, responseHeaders):
+        """ Updates the cache with a network response and returns it as a CachedResponse """
+
+        metrics.count("fetch_bytes", len(content))
+
+        if statusCode == 304 and meta is not None:
+            self._count("revalidations")
+            meta["fetched_at"] = time.time()
+            self._save(url, meta)
+            return CachedResponse(url, 200, body, meta["headers"], fromCache=True)
+
+        self._count("misses")
+        if statusCode == 200:
+            meta = {
+                "url": url,
+                "fetched_at": time.time(),
+                "headers": {
+                    name: responseHeaders[name]
+                    for name in ("ETag", "Last-Modified", "Content-Type")
+                    if name in responseHeaders
+                },
+            }
+            self._save(url, meta, content)
+
+        return CachedResponse(url, statusCode, content, dict(responseHeaders))
+
+    def get(self, url, headers=None, **kwargs):
+        """ GETs url, serving it from the cache when possible. Only 200 responses are cached """
+
+        url = url.strip()
+        cached, meta, body, requestHeaders = self._lookup(url, headers)
+        if cached is not None:
+            return cached
+
+        with metrics.stage("fetch"):
+            response = self.session.get(url, headers=requestHeaders, **kwargs)
+        return self._record(url, meta, body, response.status_code, response.content, response.headers)
+
+    async def get_async(self, session, url, headers=None):
+        """ Same as get(), fetching through an aiohttp ClientSession instead of the requests session """
+
+        url = url.strip()
+        # Reading and writing cache entries blocks: do it on the default executor, not the event loop
+        loop = asyncio.get_running_loop()
+        cached, meta, body, requestHeaders = await loop.run_in_executor(None, self._lookup, url, headers)
+        if cached is not None:
+            return cached
+
+        with metrics.stage("fetch"):
+            async with session.get(url, headers=requestHeaders) as response:
+                statusCode = response.status
+                content = await response.read()
+                responseHeaders = response.headers
+        return await loop.run_in_executor(
+            None, self._record, url, meta, body, statusCode, content, responseHeaders
+        )
+
+    def stats(self):
+        """ Returns the cache's hit/revalidation/miss counters """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+            }
+
+
+# Cache shared by every scraper. Configure it with environment variables:
+# HTTP_CACHE_DIR, HTTP_CACHE_TTL (seconds) and HTTP_CACHE_OFFLINE=1 for cache-only runs
+http_cache = HTTPCache(
+    os.getenv(
+        "HTTP_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "sentence-mining", "http"),
+    ),
+    ttl=int(os.getenv("HTTP_CACHE_TTL", 24 * 60 * 60)),
+    offline=os.getenv("HTTP_CACHE_OFFLINE", "0") == "1",
+)
+
+
+def cached_get(url, headers=None, **kwargs):
+    """ GETs url through the shared HTTP cache """
+
+    return http_cache.get(url, headers=headers, **kwargs)
+
+
+async def cached_get_async(session, url, headers=None):
+    """ GETs url through the shared HTTP cache, using an aiohttp ClientSession on a miss """
+
+    return await http_cache.get_async(session, url, headers=headers)
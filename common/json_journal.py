@@ -0,0 +1,139 @@
+import os
+import json
+import threading
+
+from .json_stream import iter_json_object
+
+
+class JournaledJSON:
+    """ A JSON object file that is updated through an append-only journal.
+
+    Updates made with set() are appended to `<path>.journal` in batches of `batchSize`,
+    instead of rewriting the whole JSON file every time. The journal is replayed when the
+    store is opened, and compacted back into the regular JSON file every `compactEvery`
+    journaled entries and on close(), so other scripts can keep reading `path` with json.load().
+    """
+
+    def __init__(self, path, batchSize=100, compactEvery=10000, indent=4):
+        self.path = path
+        self.journalPath = f"{path}.journal"
+        self.batchSize = batchSize
+        self.compactEvery = compactEvery
+        self.indent = indent
+        self._pending = list()
+        self._journaled = 0
+        self._lock = threading.RLock()
+
+        self.data = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            # Stream the items instead of reading the whole document into a string first
+            data = dict(iter_json_object(self.path))
+        else:
+            data = dict()
+
+        # Replay updates that were not compacted yet
+        if os.path.exists(self.journalPath):
+            with open(self.journalPath, "rb+") as journal:
+                # Offset right after the last complete entry
+                goodEnd = 0
+                for line in journal:
+                    # Last line may be truncated if a run was killed
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        key, value = json.loads(line)
+                    except ValueError:
+                        break
+                    data[key] = value
+                    self._journaled += 1
+                    goodEnd += len(line)
+
+                # Drop the truncated line, so the next flush() doesn't append entries onto it
+                if goodEnd < os.path.getsize(self.journalPath):
+                    journal.truncate(goodEnd)
+
+        return data
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def items(self):
+        return self.data.items()
+
+    def keys(self):
+        return self.data.keys()
+
+    def set(self, key, value):
+        """ Updates a key. The update is journaled once batchSize updates are pending """
+
+        with self._lock:
+            self.data[key] = value
+            self._pending.append((key, value))
+            if len(self._pending) >= self.batchSize:
+                self.flush()
+
+    def replace(self, data):
+        """ Replaces the whole content of the store and writes it to disk right away """
+
+        with self._lock:
+            self.data = data
+            self._pending.clear()
+            self.compact()
+
+    def flush(self):
+        """ Appends pending updates to the journal """
+
+        with self._lock:
+            if not self._pending:
+                return
+
+            with open(self.journalPath, "a", encoding="utf8") as journal:
+                for key, value in self._pending:
+                    journal.write(json.dumps([key, value], ensure_ascii=False) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            self._journaled += len(self._pending)
+            self._pending.clear()
+
+            if self._journaled >= self.compactEvery:
+                self.compact()
+
+    def compact(self):
+        """ Rewrites the JSON file with every update applied and empties the journal """
+
+        with self._lock:
+            temporaryPath = f"{self.path}.tmp"
+            with open(temporaryPath, "w", encoding="utf8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=self.indent)
+            os.replace(temporaryPath, self.path)
+
+            # Pending updates are already part of the JSON file now
+            self._pending.clear()
+            if os.path.exists(self.journalPath):
+                os.remove(self.journalPath)
+            self._journaled = 0
+
+    def close(self):
+        """ Flushes pending updates and compacts the journal into the JSON file """
+
+        with self._lock:
+            self.flush()
+            self.compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,237 @@
+import os
+import json
+import threading
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# Characters that can follow a complete JSON value
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+class _Reader:
+    """ Buffered reader handing out JSON values from a text file, one at a time """
+
+    def __init__(self, f, chunkSize):
+        self.f = f
+        self.chunkSize = chunkSize
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _read_more(self):
+        chunk = self.f.read(self.chunkSize)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """ Skips whitespace and returns the next character ("" at the end of the file) """
+
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer) or not self._read_more():
+                return self.buffer[self.position : self.position + 1]
+
+    def expect(self, characters):
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in JSON stream, found {character!r}")
+        self.position += 1
+        return character
+
+    def value(self):
+        """ Decodes the next JSON value. A value is only accepted once it is followed by a delimiter
+        (or the end of the file): a number cut by the end of a chunk ("12." or "1e") decodes without
+        error, but only to its first part, so more is read first """
+
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+
+            if (end < len(self.buffer) and self.buffer[end] in _DELIMITERS) or not self._read_more():
+                self.position = end
+                return value
+
+
+def iter_json_object(path, chunkSize=1 << 20):
+    """ Yields the (key, value) pairs of a JSON object file one by one, without loading the whole
+    document: memory use is bounded by the largest value, not by the size of the file """
+
+    with open(path, "r", encoding="utf8") as f:
+        reader = _Reader(f, chunkSize)
+        if reader.peek() == "":  # Empty file
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            yield key, reader.value()
+            if reader.expect(",}") == "}":
+                return
+
+
+class JSONObjectWriter:
+    """ Writes a JSON object file one item at a time, one item per line.
+
+    The object is written to a temporary file that replaces `path` when the writer is closed,
+    so readers never see a partial file, and an interrupted run leaves the previous file intact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.temporaryPath = f"{path}.tmp"
+        self._file = open(self.temporaryPath, "w", encoding="utf8")
+        self._file.write("{")
+        self.written = 0
+
+    def write(self, key, value):
+        separator = "\n    " if self.written == 0 else ",\n    "
+        self._file.write(f"{separator}{json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}")
+        self.written += 1
+
+    def write_all(self, items):
+        for key, value in items:
+            self.write(key, value)
+
+    def close(self):
+        self._file.write("\n}\n")
+        self._file.close()
+        os.replace(self.temporaryPath, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, *exc):
+        if excType is None:
+            self.close()
+        else:
+            # Keep the previous file as it was
+            self._file.close()
+            os.remove(self.temporaryPath)
+
+
+def _complete_lines(path):
+    """ Drops a last line cut short by a crash from a JSON lines file. Returns how many lines are left """
+
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            content = content[: content.rfind(b"\n") + 1]
+            f.truncate(len(content))
+    return content.count(b"\n")
+
+
+def iter_json_lines(path):
+    """ Yields the (key, value) pairs of a JSON lines journal, one [key, value] array per line.
+    Stops at a line cut short by a crash; yields nothing if the file doesn't exist """
+
+    if not os.path.exists(path):
+        return
+
+    with open(path, "r", encoding="utf8") as journal:
+        for line in journal:
+            if not line.endswith("\n"):
+                return
+            key, value = json.loads(line)
+            yield key, value
+
+
+class JSONLinesJournal:
+    """ Thread-safe, append-only journal of (key, value) pairs, one JSON [key, value] array per line.
+    Every append is flushed, so a killed run loses at most the line being written """
+
+    def __init__(self, path):
+        self.path = path
+        _complete_lines(path)
+        self._file = open(path, "a", encoding="utf8")
+        self._lock = threading.Lock()
+
+    def append(self, key, value):
+        line = json.dumps([key, value], ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_json_lines(path, journalPath):
+    """ Rewrites the JSON object file path with the items of journalPath appended (or updated),
+    then removes the journal. Both files are streamed; only the journal's keys are kept in memory """
+
+    journaledKeys = {key for key, _ in iter_json_lines(journalPath)}
+    with JSONObjectWriter(path) as output:
+        if os.path.exists(path):
+            output.write_all(
+                (key, value) for key, value in iter_json_object(path) if key not in journaledKeys
+            )
+        output.write_all(iter_json_lines(journalPath))
+    if os.path.exists(journalPath):
+        os.remove(journalPath)
+
+
+def stream_update(sourcePath, outputPath, update, batches=None, workers=8, window=64):
+    """ Writes every item of the JSON object file sourcePath to outputPath, in the same order, with
+    the values returned by update(batch) for each batch of (key, value) items.
+
+    Items are grouped by batches(items) (one item per batch by default) and updated on `workers`
+    threads, with at most `window` batches in flight. Results are appended to
+    `<outputPath>.progress` in source order as they complete; an interrupted run resumes after
+    the last one, and outputPath is only replaced once every item is done. Memory use is bounded
+    by the window, whatever the size of the files. sourcePath may be outputPath.
+    """
+
+    progressPath = f"{outputPath}.progress"
+    # Items done by a previous, interrupted run
+    done = _complete_lines(progressPath)
+    if done:
+        print(f"Resuming after {done} items already in {progressPath}.")
+
+    items = itertools.islice(iter_json_object(sourcePath), done, None)
+    if batches is None:
+        batches = lambda items: ([item] for item in items)
+
+    inFlight = collections.deque()
+    with JSONLinesJournal(progressPath) as progress, ThreadPoolExecutor(workers) as executor:
+
+        def write_oldest():
+            future, batch = inFlight.popleft()
+            # Later batches can't be written before this one without losing the order: a failure stops here
+            for (key, _), value in zip(batch, future.result()):
+                progress.append(key, value)
+
+        for batch in batches(items):
+            inFlight.append((executor.submit(update, batch), batch))
+            if len(inFlight) >= window:
+                write_oldest()
+        while inFlight:
+            write_oldest()
+
+    with JSONObjectWriter(outputPath) as output:
+        output.write_all(iter_json_lines(progressPath))
+    os.remove(progressPath)
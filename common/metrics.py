@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+import multiprocessing.util
+
+# Upper bounds (in seconds) of the latency histograms' buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _NoopTimer:
+    """ Returned by Metrics.stage() when metrics are disabled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """ Latency histogram with fixed buckets, like a Prometheus histogram """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucketCounts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        """ Returns (upper bound, observations at or below it) pairs, ending with +Inf """
+
+        total = 0
+        counts = list()
+        for bound, bucketCount in zip(list(self.buckets) + [float("inf")], self.bucketCounts):
+            total += bucketCount
+            counts.append((bound, total))
+        return counts
+
+    def quantile(self, q):
+        """ Estimates a quantile as the upper bound of the bucket it falls in """
+
+        target = q * self.count
+        for bound, total in self.cumulative_counts():
+            if total >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """ Per-stage latency histograms and counters (bytes, retries, cache hits...) of a scraping run.
+
+    Code to measure is wrapped in `with metrics.stage("fetch"):`, and counters are bumped with
+    metrics.count("fetch_bytes", len(content)). When disabled, stage() returns a shared no-op
+    context manager and count() returns right away, so instrumentation costs next to nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.startedAt = time.time()
+        self.histograms = dict()
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """ Context manager timing a stage of the pipeline """
+
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _StageTimer(self, name)
+
+    def observe(self, name, seconds):
+        """ Records a stage's latency, in seconds """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def count(self, name, value=1):
+        """ Adds value to a counter """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        """ Forgets every recorded latency and counter """
+
+        self.startedAt = time.time()
+        self.histograms = dict()
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def summary(self):
+        """ Returns every stage's latency statistics and every counter, as a dict """
+
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self.startedAt,
+                "elapsed_seconds": time.time() - self.startedAt,
+                "stages": {
+                    name: {
+                        "count": histogram.count,
+                        "total_seconds": histogram.sum,
+                        "mean_seconds": histogram.sum / histogram.count,
+                        "p50_seconds": histogram.quantile(0.5),
+                        "p95_seconds": histogram.quantile(0.95),
+                        "max_seconds": histogram.max,
+                    }
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def prometheus_text(self):
+        """ Returns the metrics in the Prometheus text exposition format """
+
+        pid = os.getpid()
+        lines = [
+            "# HELP scraper_stage_seconds Latency of each stage of the scrapers.",
+            "# TYPE scraper_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                labels = f'stage="{name}",pid="{pid}"'
+                for bound, total in histogram.cumulative_counts():
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f'scraper_stage_seconds_bucket{{{labels},le="{le}"}} {total}')
+                lines.append(f"scraper_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"scraper_stage_seconds_count{{{labels}}} {histogram.count}")
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE scraper_{name}_total counter")
+                lines.append(f'scraper_{name}_total{{pid="{pid}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, directory, name=None):
+        """ Writes the JSON summary and the Prometheus textfile (<name>.json and <name>.prom)
+        to directory. Each process writes its own files, named after its pid by default """
+
+        if name is None:
+            name = f"run-{os.getpid()}"
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to temporary files and rename, so collectors never read partial files
+        for extension, text in (
+            ("json", json.dumps(self.summary(), indent=4)),
+            ("prom", self.prometheus_text()),
+        ):
+            path = os.path.join(directory, f"{name}.{extension}")
+            with open(f"{path}.tmp", "w", encoding="utf8") as f:
+                f.write(text)
+            os.replace(f"{path}.tmp", path)
+
+
+# Metrics shared by every scraper. Set SCRAPER_METRICS=1 to enable them; each process then writes
+# its reports to METRICS_DIR (metrics/ by default) when it exits, including multiprocessing workers
+metrics = Metrics(enabled=os.getenv("SCRAPER_METRICS", "0") == "1")
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+
+
+def _reset_in_child():
+    # Forked workers (multiprocessing pools) report only what they measured themselves
+    metrics.reset()
+
+
+def _write_reports_at_exit():
+    if metrics.enabled and (metrics.histograms or metrics.counters):
+        metrics.write_reports(METRICS_DIR)
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+atexit.register(_write_reports_at_exit)
+multiprocessing.util.Finalize(metrics, _write_reports_at_exit, exitpriority=10)
@@ -0,0 +1,116 @@
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .metrics import metrics
+
+# Put on a stage's queue once its input is exhausted
+_DONE = object()
+
+
+class Stage:
+    """ One step of a Pipeline: `workers` threads taking items from a bounded queue.
+
+    Each item is passed to `function`, which returns an iterable of items for the next stage
+    (or None). With processes=True, the threads hand each call to a process pool of the same
+    size instead of running it themselves, for CPU-bound work like parsing. The pool's processes
+    are spawned (not forked from a process running threads), so `function` and its items must
+    be picklable and importable: module-level functions, functools.partial...
+    """
+
+    def __init__(self, name, function, workers=4, processes=False, maxQueued=64):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.queue = queue.Queue(maxQueued)
+        self.processed = 0
+        self.failed = 0
+        self._running = workers
+        self._lock = threading.Lock()
+
+    def _call(self, executor, item):
+        with metrics.stage(self.name):
+            if executor is None:
+                return self.function(item)
+            return executor.submit(self.function, item).result()
+
+    def _work(self, nextStage, executor):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                break
+
+            try:
+                outputs = self._call(executor, item)
+                # Blocks while the next stage's queue is full, so fast stages can't run ahead
+                if nextStage is not None and outputs is not None:
+                    for output in outputs:
+                        nextStage.queue.put(output)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                print(f"[{self.name}] Failed processing {str(item)[:100]}: {e}")
+                with self._lock:
+                    self.failed += 1
+
+        # The last worker to finish tells the next stage there is nothing more to come
+        with self._lock:
+            self._running -= 1
+            lastWorker = self._running == 0
+        if lastWorker and nextStage is not None:
+            for _ in range(nextStage.workers):
+                nextStage.queue.put(_DONE)
+
+
+class Pipeline:
+    """ Stages connected by bounded queues, all running at the same time.
+
+    Items from the source go through every stage in order; a stage starts on an item as soon
+    as the previous one emits it, so fetching, parsing, TTS and exporting overlap instead of
+    running one after the other. Full queues block the stages feeding them (backpressure),
+    which keeps memory bounded however large the source is.
+    """
+
+    def __init__(self, maxQueued=64):
+        self.maxQueued = maxQueued
+        self.stages = list()
+
+    def add_stage(self, name, function, workers=4, processes=False):
+        self.stages.append(Stage(name, function, workers, processes, self.maxQueued))
+        return self
+
+    def run(self, source):
+        """ Feeds every item of source to the first stage and waits until all stages are done """
+
+        executors = [
+            ProcessPoolExecutor(stage.workers, mp_context=multiprocessing.get_context("spawn"))
+            if stage.processes
+            else None
+            for stage in self.stages
+        ]
+        threads = list()
+        for i, stage in enumerate(self.stages):
+            nextStage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=stage._work, args=(nextStage, executors[i]), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            firstStage = self.stages[0]
+            for item in source:
+                firstStage.queue.put(item)
+            for _ in range(firstStage.workers):
+                firstStage.queue.put(_DONE)
+
+            for thread in threads:
+                thread.join()
+        finally:
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown()
+
+        for stage in self.stages:
+            print(f"[{stage.name}] {stage.processed} processed, {stage.failed} failed.")
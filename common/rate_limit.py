@@ -0,0 +1,93 @@
+import random
+import time
+import threading
+
+from .metrics import metrics
+
+
+class TokenBucket:
+    """ Thread-safe token bucket. Tokens refill at `rate` per second, up to `capacity` """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updatedAt = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requestsPerMinute, burst=1):
+        """ Builds a bucket allowing requestsPerMinute requests, with bursts of up to `burst` """
+
+        return cls(requestsPerMinute / 60, burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updatedAt) * self.rate)
+        self._updatedAt = now
+
+    def acquire(self, tokens=1):
+        """ Blocks until `tokens` tokens are available and consumes them """
+
+        # The bucket never holds more than its capacity, so waiting for more would block forever
+        if tokens > self.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket holding at most {self.capacity}.")
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """ Token bucket that slows down when the server pushes back.
+
+    penalize() halves the rate (down to minRate) and reward() slowly brings it back up to
+    the configured rate, so throughput settles just under what the server accepts.
+    """
+
+    def __init__(self, rate, capacity=1, minRate=None):
+        super().__init__(rate, capacity)
+        self.maxRate = rate
+        self.minRate = minRate if minRate is not None else rate / 32
+
+    def penalize(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.minRate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 20)
+
+
+def call_with_retries(call, limiter, isRetryable, retries=5, baseDelay=1.0, maxDelay=60.0):
+    """ Calls call() under the limiter, retrying with exponential backoff (and jitter) while
+    isRetryable(exception) is true. Re-raises the last exception when retries run out """
+
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = call()
+        except Exception as e:
+            if attempt >= retries or not isRetryable(e):
+                raise
+            if isinstance(limiter, AdaptiveTokenBucket):
+                limiter.penalize()
+
+            delay = min(maxDelay, baseDelay * 2 ** attempt) * random.uniform(0.5, 1)
+            print(f"Request failed ({e}). Retrying in {delay:.1f}s...")
+            metrics.count("retries")
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if isinstance(limiter, AdaptiveTokenBucket):
+            limiter.reward()
+        return result
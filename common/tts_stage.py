@@ -0,0 +1,63 @@
+import queue
+import threading
+
+from .rate_limit import TokenBucket
+
+
+class TTSStage:
+    """ Pipeline stage running text-to-speech jobs on a pool of worker threads.
+
+    Jobs are queued with submit() and drained by `workers` threads, under a budget of
+    `requestsPerMinute` calls to `synthesize`. The queue holds at most `maxQueued` jobs,
+    so producers block (instead of piling up memory) when synthesis falls behind.
+    """
+
+    def __init__(self, synthesize, workers=8, requestsPerMinute=500, maxQueued=64):
+        self._synthesize = synthesize
+        self._queue = queue.Queue(maxQueued)
+        self._limiter = TokenBucket.per_minute(requestsPerMinute, burst=workers)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, *args):
+        """ Queues a synthesize(*args) call, blocking while the queue is full """
+
+        self._queue.put(args)
+
+    def _work(self):
+        while True:
+            args = self._queue.get()
+            if args is None:  # Sentinel sent by close()
+                break
+
+            self._limiter.acquire()
+            try:
+                self._synthesize(*args)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                print(f"Failed generating audio for {args}: {e}")
+                with self._lock:
+                    self.failed += 1
+
+    def close(self):
+        """ Waits for every queued job to finish and stops the workers """
+
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        print(f"TTS stage finished: {self.completed} audios generated, {self.failed} failed.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
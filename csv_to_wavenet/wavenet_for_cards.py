@@ -1,32 +1,123 @@
+""" Adds a WaveNet audio to every card of an Anki export, writing the cards to a new .tsv file.
+
+The export is read in chunks and sentences are synthesized on a pool of threads, under a budget
+of requests per minute. Cards are appended to the output in the export's order as soon as their
+audio is ready, so an interrupted run can be resumed where it stopped. Usage:
+
+    python csv_to_wavenet/wavenet_for_cards.py [--chunk-size 500] [--workers 8] [--requests-per-minute 500]
+"""
+
+import os
+import sys
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-from reverso_scraping.wavenet import generate_audio_random, get_modified_path
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import metrics
+from common.rate_limit import TokenBucket
+from reverso_scraping.wavenet import generate_audio_random, audio_filename, load_voice_catalog, audio_cache
 
-if __name__ == "__main__":
-    with open("new_cards.tsv", "w+", encoding="utf8") as f:
-        old = pd.read_csv("exported_cards.txt", sep="\t")
-        print(old)
 
-        audiosFilenames = []
+def completed_rows(outputPath):
+    """ Returns how many cards a previous run wrote to outputPath, dropping a last line cut short by a crash """
+
+    if not os.path.exists(outputPath):
+        return 0
+
+    with open(outputPath, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+            content = content[: content.rfind(b"\n") + 1]
+    return content.count(b"\n")
+
+
+def voice_row(french, audiosPath, limiter):
+    """ Generates the audio for a card's sentence, unless it is already in audiosPath. Returns its filename """
+
+    audioFilename = audio_filename(french)
+    if os.path.exists(f"{audiosPath}{audioFilename}"):
+        print(f'Audio already exists for "{french}"')
+        metrics.count("audios_skipped")
+        return audioFilename
+
+    limiter.acquire()
+    generate_audio_random(audiosPath, french, "fr-FR")
+    return audioFilename
+
 
-        allFields = list(zip(old["French"], old["English"], old["Target"], old["Tags"]))
-        # print(allFields)
+def format_row(french, english, audioFilename, target, tags):
+    if pd.isnull(target):
+        target = ""
+    if pd.isnull(tags):
+        tags = ""
+    return f"{french}\t{english}\t[sound:{audioFilename}]\t{target}\t{tags}\n"
 
-        for french, english, target, tags in allFields:
-            generate_audio_random("audios/", french, "fr-FR")
-            audioFilename = get_modified_path(french)
-            audiosFilenames.append(audioFilename)
 
-            print(french)
-            print(english)
-            print(audioFilename)
+def cards_to_wavenet(inputPath, outputPath, audiosPath="audios/", chunkSize=500, workers=8, requestsPerMinute=500):
+    """ Streams the cards of inputPath to outputPath, adding an audio to each one """
 
-            if pd.isnull(target):
-                target = ""
-            if pd.isnull(tags):
-                tags = ""
+    os.makedirs(audiosPath, exist_ok=True)
+    # Load voices once, from the snapshot if possible, instead of once per sentence
+    load_voice_catalog()
+
+    # Resume from the last card written by a previous run
+    skipRows = completed_rows(outputPath)
+    if skipRows:
+        print(f"Resuming after {skipRows} cards already in {outputPath}.")
+
+    limiter = TokenBucket.per_minute(requestsPerMinute, burst=workers)
+    # Cards waiting for their audio, in the export's order; at most 2 * workers at a time
+    inFlight = collections.deque()
+    written = 0
+
+    with open(outputPath, "a", encoding="utf8") as f, ThreadPoolExecutor(workers) as executor:
+
+        def write_oldest():
+            nonlocal written
+            future, (french, english, target, tags) = inFlight.popleft()
+            try:
+                audioFilename = future.result()
+            except Exception as e:
+                # Later cards can't be written before this one without losing the order: stop here
+                raise RuntimeError(f"Failed generating audio for {french}, stopping after {written} new cards.") from e
+
+            with metrics.stage("write"):
+                f.write(format_row(french, english, audioFilename, target, tags))
+                # Every written line is a completed card, even if the run dies right after
+                f.flush()
+            written += 1
+
+        reader = pd.read_csv(
+            inputPath, sep="\t", chunksize=chunkSize, skiprows=range(1, skipRows + 1)
+        )
+        for chunk in reader:
+            for french, english, target, tags in zip(chunk["French"], chunk["English"], chunk["Target"], chunk["Tags"]):
+                future = executor.submit(voice_row, french, audiosPath, limiter)
+                inFlight.append((future, (french, english, target, tags)))
+                if len(inFlight) >= 2 * workers:
+                    write_oldest()
+            print(f"{skipRows + written} cards written to {outputPath}.")
+
+        while inFlight:
+            write_oldest()
+
+    print(f"Done: {written} new cards written to {outputPath}, {skipRows + written} in total.")
+    print(f"Audio cache: {audio_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adds WaveNet audios to exported Anki cards")
+    parser.add_argument("--input", default="exported_cards.txt", help="Anki export, tab-separated, with a header")
+    parser.add_argument("--output", default="new_cards.tsv")
+    parser.add_argument("--audios", default="audios/", help="where generated audios are written")
+    parser.add_argument("--chunk-size", type=int, default=500, help="export rows read at a time")
+    parser.add_argument("--workers", type=int, default=8, help="sentences synthesized at the same time")
+    parser.add_argument("--requests-per-minute", type=int, default=500, help="TTS requests budget")
+    args = parser.parse_args()
 
-            print(f"Writing info to file...")
-            f.write(
-                f"{french}\t{english}\t[sound:{audioFilename}.mp3]\t{target}\t{tags}\n"
-            )
+    cards_to_wavenet(args.input, args.output, args.audios, args.chunk_size, args.workers, args.requests_per_minute)
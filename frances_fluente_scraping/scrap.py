@@ -1,68 +1,136 @@
+import os
 import re
 import sys
 import requests
 from bs4 import BeautifulSoup
-import shutil
-import itertools
+from concurrent.futures import ThreadPoolExecutor
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import cached_get
+from common.export import get_sink, merge_shards
+from common.download import download_files
+from common.dedup import claim_cards, release_sentences
+from common.metrics import metrics
+from common.formatting import Formatter, sub, replace, strip, STRONG_TO_BOLD_UNDERLINE, ADD_FULL_STOP
 
-def download_file(url):
-    """ Downloads url to audios folder """
 
-    local_filename = url.split("/")[-1]
-    with requests.get(url, stream=True) as r:
-        with open(f"audios/{local_filename}", "wb") as f:
-            shutil.copyfileobj(r.raw, f)
+# Rules for french sentences
+FRENCH_FORMATTER = Formatter(
+    # Removes div tags
+    replace("""<div class="post__player-title">""", ""),
+    replace("</div>", ""),
+    # Replaces <strong> tags with bold and underline
+    STRONG_TO_BOLD_UNDERLINE,
+    # Removes extra whitespace
+    replace("  ", " "),
+    strip(),
+    ADD_FULL_STOP,
+)
 
-    return local_filename
+# Rules for portuguese sentences
+PORTUGUESE_FORMATTER = Formatter(
+    # Removes div tags and extra whitespace
+    sub(r"\s\s+", " "),
+    replace("""<div class="post__player-text">""", ""),
+    replace("</div>", ""),
+    # Replaces <strong> tags with bold and underline
+    STRONG_TO_BOLD_UNDERLINE,
+    # Removes extra whitespace
+    replace("  ", " "),
+    strip(),
+    ADD_FULL_STOP,
+)
 
 
 def format_french_sentence(sentence):
     """ Cleans a french sentence. Returns the new sentence """
 
-    # Removes div tags
-    sentence = sentence.replace("""<div class="post__player-title">""", "")
-    sentence = sentence.replace("</div>", "")
+    return FRENCH_FORMATTER.format(sentence)
 
-    # Replaces <strong> tags with bold and underline
-    sentence = re.sub(r"<strong>\s*", "<b><u>", sentence)
-    sentence = re.sub(r"(\W*)\s*<\/strong>", r"</u></b>\1", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)(\w+)", r"\1 \2", sentence)
 
-    # Removes extra whitespace
-    sentence = sentence.replace("  ", " ").strip()
+def format_portuguese_sentence(sentence):
+    """ Cleans a portuguese sentence. Returns the new sentence """
 
-    # Adds full stop if necessary
-    # print(sentence)
-    sentence = re.sub(r"(\w+)\Z", r"\1.", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)\Z", r"\1.", sentence)
+    return PORTUGUESE_FORMATTER.format(sentence)
 
-    return sentence
 
+def fetch_post(targetPost):
+    """ GETs a post. Returns its HTML content, or None if the request failed """
 
-def format_portuguese_sentence(sentence):
-    """ Cleans a portuguese sentence. Returns the new sentence """
+    headers = {
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
+    }
+    req = cached_get(targetPost, headers=headers)
+    if req.status_code != 200:
+        print("Failed GET request.")
+        return None
+    print("Successful GET request!")
+    return req.content
 
-    # Removes div tags and extra whitespace
-    sentence = re.sub(r"\s\s+", " ", sentence)
-    sentence = sentence.replace("""<div class="post__player-text">""", "")
-    sentence = sentence.replace("</div>", "")
-    # print(sentence)
 
-    # Replaces <strong> tags with bold and underline
-    sentence = re.sub(r"<strong>\s*", "<b><u>", sentence)
-    sentence = re.sub(r"(\W*)\s*<\/strong>", r"</u></b>\1", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)(\w+)", r"\1 \2", sentence)
+def parse_post(targetPost, content):
+    """ Extracts a post's cards. Returns formatted (french, portuguese, audio URL) triples """
 
-    # Removes extra whitespace
-    sentence = sentence.replace("  ", " ").strip()
+    frenchSentences = list()
+    portugueseSentences = list()
+
+    html = BeautifulSoup(content, "html.parser")
+
+    # Extracting french sentences
+    for div in html.select("div"):
+        try:
+            if "post__player-title" in div["class"]:
+                frenchSentences.append(str(div))
+        except KeyError:
+            pass
+
+    # Extracting portuguese sentences
+    for div in html.select("div"):
+        try:
+            if "post__player-text" in div["class"]:
+                portugueseSentences.append(str(div))
+        except KeyError:
+            pass
 
-    # Adds full stop if necessary
-    sentence = re.sub(r"(\w+)\Z", r"\1.", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)\Z", r"\1.", sentence)
-    # print(sentence)
+    # Extracting audios URLs
+    audiosURLs = [p.source["src"] for p in html.select("audio")]
 
-    return sentence
+    nCards = min(len(frenchSentences), len(portugueseSentences), len(audiosURLs))
+    if not len(frenchSentences) == len(portugueseSentences) == len(audiosURLs):
+        print(f"Lists don't have all the same length in '{targetPost}'. Keeping the first {nCards} cards.\n")
+
+    # Formatting sentences as a batch
+    frenchSentences = FRENCH_FORMATTER.format_all(frenchSentences)
+    portugueseSentences = PORTUGUESE_FORMATTER.format_all(portugueseSentences)
+    # print(frenchSentences)
+    # print(portugueseSentences)
+    return list(zip(frenchSentences, portugueseSentences, audiosURLs))
+
+
+def download_audios(cards):
+    """ Downloads the audios of (french, portuguese, audio URL) cards, in parallel. Returns the cards
+    whose audio was downloaded, with its filename instead of its URL """
+
+    for _, _, url in cards:
+        print(f"Downloading {url.split('/')[-1]}...")
+    audiosFilenames = download_files(card[2] for card in cards)
+    # print(audiosFilenames)
+
+    # Dropping only the cards whose audio failed to download; a later run can claim them again
+    release_sentences(card[0] for card, filename in zip(cards, audiosFilenames) if filename is None)
+    return [
+        (french, portuguese, filename)
+        for (french, portuguese, _), filename in zip(cards, audiosFilenames)
+        if filename is not None
+    ]
+
+
+def export_cards(cards):
+    # Writing to .csv according to card's fields
+    get_sink("csv", "frances_fluente", "|").write_cards(
+        [french, portuguese, f"[sound:{filename}]", "frances_fluente"] for french, portuguese, filename in cards
+    )
 
 
 def post_to_card(targetPost):
@@ -71,85 +139,57 @@ def post_to_card(targetPost):
     Write these infos into a .csv file for Anki importing
     """
 
-    name = targetPost.split("/")[3]
-    with open(f"csv/{name}.csv", "w+", encoding="utf8") as card:
-        frenchSentences = list()
-        portugueseSentences = list()
-        audiosFilenames = list()
-
-        headers = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
-        }
-        req = requests.get(targetPost, headers=headers)
-        if req.status_code == 200:
-            print("Successful GET request!")
-
-            # Retrieving the html content
-            content = req.content
-            html = BeautifulSoup(content, "html.parser")
-
-            # Extracting french sentences
-            for div in html.select("div"):
-                try:
-                    if "post__player-title" in div["class"]:
-                        frenchSentences.append(format_french_sentence(str(div)))
-                except KeyError:
-                    pass
-            # print(frenchSentences)
-
-            # Extracting portuguese sentences
-            for div in html.select("div"):
-                try:
-                    if "post__player-text" in div["class"]:
-                        portugueseSentences.append(format_portuguese_sentence(str(div)))
-                except KeyError:
-                    pass
-            # print(portugueseSentences)
-
-            # Extracting audios URLs and downloading audios
-            for p in html.select("audio"):
-                localFilename = download_file(p.source["src"])
-                audiosFilenames.append(localFilename)
-                print(f"Downloading {localFilename}...")
-            # print(audiosFilenames)
-
-            if len(frenchSentences) != len(portugueseSentences) != len(audiosFilenames):
-                print(
-                    "Lists don't have all the same length. Output may be compromised.\n"
-                )
-            # Writing to .csv according to card's fields
-            cardInfos = [
-                x
-                for x in itertools.chain.from_iterable(
-                    itertools.zip_longest(
-                        frenchSentences, portugueseSentences, audiosFilenames
-                    )
-                )
-                if x
-            ]
-            for i in range(0, len(cardInfos) - 2, 3):
-                card.write(
-                    f"{cardInfos[i]}|{cardInfos[i + 1]}|[sound:{cardInfos[i + 2]}]|frances_fluente\n"
-                )
-        else:
-            print("Failed GET request.")
+    content = fetch_post(targetPost)
+    if content is None:
+        return
 
+    with metrics.stage("parse"):
+        cards = parse_post(targetPost, content)
+    # Skipping cards whose sentence was already kept from another post, source or run
+    cards = claim_cards(cards, "frances_fluente")
 
-def crawl_page(targetPage):
+    try:
+        export_cards(download_audios(cards))
+    except BaseException:
+        # The cards were not exported: let a later run claim their sentences again
+        release_sentences(card[0] for card in cards)
+        raise
+
+
+def crawl_page(targetPage, window=8, workers=4):
     """ Crawls the target page ("Francês Fluente") to get
-    posts URLs. Save URLs whose posts have been labeled with specific categories
+    posts URLs. Save URLs whose posts have been labeled with specific categories.
+    Keeps `window` pages queued, speculatively requesting pages ahead of the one being parsed on
+    `workers` threads; queued requests past the last page are cancelled before being sent
     """
 
     page = 1  # Starting page
-    crawledLinks = list()  # Storing crawled links
+    nextPage = 1  # Next page to request
+    inFlight = dict()  # Requests for pages not parsed yet, by page number
     crawlerLimit = 0  # Limit for crawling
-    with requests.Session() as session:
+    with requests.Session() as session, ThreadPoolExecutor(min(workers, window)) as executor, open(
+        "posts_urls.txt", "w+", encoding="UTF8"
+    ) as URLsFile:
+
+        def request_page(pageNumber):
+            with metrics.stage("fetch"):
+                return session.post(
+                    "https://www.francesfluente.com/wp-admin/admin-ajax.php",
+                    data={"action": "loadmore", "query": "null", "page": pageNumber},
+                )
+
         while True:
+            # Keep the window full
+            while nextPage < page + window:
+                inFlight[nextPage] = executor.submit(request_page, nextPage)
+                nextPage += 1
+
             found = 0
-            response = session.post(
-                "https://www.francesfluente.com/wp-admin/admin-ajax.php",
-                data={"action": "loadmore", "query": "null", "page": page},
-            )
+            try:
+                response = inFlight.pop(page).result()
+            except Exception as e:
+                print(f"Failed POST request: {e}")
+                break
 
             if response.status_code == 200:
                 print("Successful POST request!")
@@ -169,7 +209,9 @@ def crawl_page(targetPage):
                     ):
                         found = 1
                         print(post["href"])
-                        crawledLinks.append(post["href"])
+                        # Saves posts URLs to the .txt file as they are found
+                        URLsFile.write(f"{post['href']}\n")
+                URLsFile.flush()
             else:
                 print("Failed POST request.")
                 break
@@ -183,11 +225,8 @@ def crawl_page(targetPage):
 
             page += 1
 
-        # Saves posts URLs to a .txt file
-        with open("posts_urls.txt", "w+", encoding="UTF8") as URLsFile:
-            for post in crawledLinks:
-                URLsFile.write(f"{post}\n")
-    pass
+        # The end was found: drop speculative requests for pages past it that haven't started yet
+        executor.shutdown(cancel_futures=True)
 
 
 def scrap_pages(postsURLsFile):
@@ -202,6 +241,10 @@ def scrap_pages(postsURLsFile):
         post_to_card(url)
         urlCounter += 1
 
+    # Merge every scraped card into csv/frances_fluente_anki.txt
+    get_sink("csv", "frances_fluente", "|").flush()
+    merge_shards("csv", "frances_fluente", separator="|")
+
 
 if __name__ == "__main__":
     try:
@@ -1,136 +1,146 @@
+import os
 import re
-import requests
+import sys
 from bs4 import BeautifulSoup
-import shutil
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import cached_get
+from common.export import get_sink, merge_shards
+from common.download import download_files
+from common.dedup import claim_cards, release_sentences
+from common.metrics import metrics
+from common.formatting import Formatter, sub, replace, strip, ADD_FULL_STOP_IGNORING_WHITESPACE
 
-def download_file(url):
-    """ Download file from URL """
 
-    local_filename = url.split("/")[-1]
-    with requests.get(url, stream=True) as r:
-        with open(f"audios/{local_filename}", "wb") as f:
-            shutil.copyfileobj(r.raw, f)
-
-    return local_filename
+# Rules for english sentences
+ENGLISH_FORMATTER = Formatter(
+    # Remove <strong> tags
+    sub(r"<\/?strong>", ""),
+    # Manage/remove extra whitespace
+    replace("&nbsp;", " "),
+    replace("\xa0", " "),
+    replace("  ", " "),
+    # Replace <u> tags with bold and underline
+    replace("<u>", "<b><u>"),
+    replace("</u>", "</b></u>"),
+    ADD_FULL_STOP_IGNORING_WHITESPACE,
+    strip(),
+)
+
+# Rules for portuguese sentences
+PORTUGUESE_FORMATTER = Formatter(
+    # Remove <a>, <em> tags and extra whitespace
+    sub(r"\s\s+", " "),
+    sub(r"<\/?em>", ""),
+    sub(r"<\/?a>", ""),
+    # Replace <u> tags with bold and underline
+    replace("<u>", "<b><u>"),
+    replace("</u>", "</b></u>"),
+    ADD_FULL_STOP_IGNORING_WHITESPACE,
+    strip(),
+)
 
 
 def format_english_sentence(sentence):
     """ Cleans a english sentence. Returns the new sentence """
 
-    # Remove <strong> tags
-    sentence = re.sub(r"<\/?strong>", "", sentence)
+    return ENGLISH_FORMATTER.format(sentence)
 
-    # Manage/remove extra whitespace
-    sentence = sentence.replace("&nbsp;", " ")
-    sentence = sentence.replace("\xa0", " ")
-    sentence = sentence.replace("  ", " ")
 
-    # Replace <u> tags with bold and underline
-    sentence = re.sub(r"<u>", "<b><u>", sentence)
-    sentence = re.sub(r"<\/u>", "</b></u>", sentence)
+def format_portuguese_sentence(sentence):
+    """ Cleans a portuguese sentence. Returns the new sentence """
 
-    # Add full stop if necessary
-    sentence = re.sub(r"(\w+)\s*\Z", r"\1.", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)\s*\Z", r"\1.", sentence)
+    return PORTUGUESE_FORMATTER.format(sentence)
 
-    return sentence.strip()
 
+def fetch_post(targetURL):
+    """ GETs a post. Returns its HTML content, or None if the request failed """
 
-def format_portuguese_sentence(sentence):
-    """ Cleans a portuguese sentence. Returns the new sentence """
+    # Headers for the GET request so it doesn't get easily rejected
+    headers = {
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
+    }
 
-    # Remove <a>, <em> tags and extra whitespace
-    sentence = re.sub(r"\s\s+", " ", sentence)
-    sentence = re.sub(r"<\/?em>", "", sentence)
-    sentence = re.sub(r"<\/?a>", "", sentence)
-    # print(sentence)
+    req = cached_get(targetURL, headers=headers)
+    if req.status_code != 200:
+        print("Failed GET request.")
+        return None
+    print("Successful GET request!")
+    return req.content
+
+
+def parse_post(targetURL, content):
+    """ Extracts a post's cards. Returns formatted (english, portuguese, audio URL) triples """
+
+    html = BeautifulSoup(content, "html.parser")
+
+    # Extract sentences
+    div = html.find("div", class_="post-content")
+    # Sentences are under this div
+    # divStrings = "".join(list(map(str, div)))
+    # print(divStrings)
+    sentencesRegex = (
+        # BeautifulSoup serializes line breaks as <br/>, whatever the page has
+        r"(?:<p.*?>(.*?)<em>(.*?)<br/?><span.*?><audio .*?src=\"(.*?)\")"
+    )
+    findSentences = re.findall(
+        sentencesRegex, "".join(list(map(str, div))), re.MULTILINE
+    )
+    if not findSentences:
+        # Extract post title from URL, used in messages
+        print(f"No sentences found in '{targetURL.split('/')[3]}'.")
+
+    # Clean and format English and Portuguese
+    englishSentences = ENGLISH_FORMATTER.format_all(matches[0] for matches in findSentences)
+    portugueseSentences = PORTUGUESE_FORMATTER.format_all(matches[1] for matches in findSentences)
+    # Add domain to audio URLs
+    audiosURLs = [f"https://blog.influx.com.br{matches[2]}" for matches in findSentences]
+    return list(zip(englishSentences, portugueseSentences, audiosURLs))
 
-    # Replace <u> tags with bold and underline
-    sentence = re.sub(r"<u>", "<b><u>", sentence)
-    sentence = re.sub(r"<\/u>", "</b></u>", sentence)
 
-    # Add full stop if necessary
-    sentence = re.sub(r"(\w+)\s*\Z", r"\1.", sentence)
-    sentence = re.sub(r"(<\/u><\/b>)\s*\Z", r"\1.", sentence)
+def download_audios(cards):
+    """ Downloads the audios of (english, portuguese, audio URL) cards, in parallel. Returns the cards
+    whose audio was downloaded, with its filename instead of its URL """
 
-    return sentence.strip()
+    for _, _, url in cards:
+        print(f"Downloading {url}")
+    audioFilenames = download_files(card[2] for card in cards)
+
+    # Drop only the cards whose audio failed to download; a later run can claim them again
+    release_sentences(card[0] for card, filename in zip(cards, audioFilenames) if filename is None)
+    return [
+        (english, portuguese, filename)
+        for (english, portuguese, _), filename in zip(cards, audioFilenames)
+        if filename is not None
+    ]
+
+
+def export_cards(cards):
+    # Use TAB as separator
+    get_sink("csv", "influx", "\t").write_cards(
+        [english, portuguese, f"[sound:{filename}]", "english_influx"] for english, portuguese, filename in cards
+    )
 
 
 def scrap_page(targetURL):
     """ Scraps a single URL for sentences, downloading audios """
 
-    # Extract post title from URL and use as .csv file name
-    name = targetURL.split("/")[3]
-    with open(f"csv/{name}.csv", "w+", encoding="utf8") as card:
-        # Headers for the GET request so it doesn't get easily rejected
-        headers = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
-        }
-
-        req = requests.get(targetURL, headers=headers)
-        if req.status_code == 200:
-            print("Successful GET request!")
-
-            # Initialize lists for later appending
-            englishSentences = list()
-            portugueseSentences = list()
-            audiosURLs = list()
-            audioFilenames = list()
-
-            content = req.content
-            html = BeautifulSoup(content, "html.parser")
-
-            # Extract sentences
-            div = html.find("div", class_="post-content")
-            # Sentences are under this div
-            # divStrings = "".join(list(map(str, div)))
-            # print(divStrings)
-            sentencesRegex = (
-                r"(?:<p.*?>(.*?)<em>(.*?)<br><span.*?><audio .*?src=(\".*?\"))"
-            )
-            findSentences = re.findall(
-                sentencesRegex, "".join(list(map(str, div))), re.MULTILINE
-            )
-            for matches in findSentences:
-                englishSentences.append(matches[0])
-                portugueseSentences.append(matches[1])
-                audiosURLs.append(matches[2])
-            del findSentences
-
-            audiosURLs = list(
-                # Add domain to audio URLs
-                map(lambda url: f"https://blog.influx.com.br{url}", audiosURLs)
-            )
-            portugueseSentences = list(
-                # Clean and format Portuguese
-                map(format_portuguese_sentence, portugueseSentences)
-            )
-            englishSentences = list(
-                # Clean and format English
-                map(format_english_sentence, englishSentences)
-            )
-
-            # Download audios
-            for url in audiosURLs:
-                print(f"Downloading {url}")
-                localFilename = download_file(url)
-                audioFilenames.append(localFilename)
-
-            if len(portugueseSentences) != len(englishSentences) != len(audioFilenames):
-                print(
-                    f"""Lists don't have all the same length. Output may be compromised.
-- in '{name}':
-    ({len(englishSentences)} english sentences, {len(portugueseSentences)} portuguese sentences, {len(audioFilenames)} audio files.)"""
-                )
-
-            cardInfos = zip(englishSentences, portugueseSentences, audioFilenames)
-            for sentence in cardInfos:
-                card.write(
-                    f"{sentence[0]}\t{sentence[1]}\t[sound:{sentence[2]}]\tenglish_influx\n"
-                )  # Use TAB as separator
-        else:
-            print("Failed GET request.")
+    content = fetch_post(targetURL)
+    if content is None:
+        return
+
+    with metrics.stage("parse"):
+        cards = parse_post(targetURL, content)
+    # Skip cards whose sentence was already kept from another post, source or run
+    cards = claim_cards(cards, "influx")
+
+    try:
+        export_cards(download_audios(cards))
+    except BaseException:
+        # The cards were not exported: let a later run claim their sentences again
+        release_sentences(card[0] for card in cards)
+        raise
 
 
 if __name__ == "__main__":
@@ -141,3 +151,8 @@ if __name__ == "__main__":
     # for page in pages:
     #     print(f"\n- Scraping {page}")
     #     scrap_page(page[:-1])  # Remove '\n' from string
+
+    # Merge every scraped card into csv/influx_anki.txt
+    # get_sink("csv", "influx", "\t").flush()
+    # merge_shards("csv", "influx")
+    pass
@@ -1,166 +1,194 @@
 from pathlib import Path
-import re
+import os
+import sys
+import time
 import logging
 import requests
 from bs4 import BeautifulSoup
-import shutil
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import cached_get
+from common.export import get_sink, merge_shards
+from common.download import download_files
+from common.dedup import claim_cards, release_sentences
+from common.metrics import metrics
+from common.formatting import Formatter, sub, replace, strip, ADD_FULL_STOP_IGNORING_WHITESPACE
+
+# Logger for failed parsings (failed.log, when the script is run)
+failedLogger = logging.getLogger("failed")
+failedLogger.setLevel(logging.ERROR)
+
+
+# Replace <u> and underlined <span> tags with bold and underline
+UNDERLINE_TO_BOLD_UNDERLINE = [
+    sub(r"<u>\s*", "<b><u>"),
+    sub(r"(\W*)\s*<\/u>", r"</u></b>\1"),
+    sub(r"<span style=\"text-decoration: underline;\">\s*", "<b><u>"),
+    sub(r"(\W*)\s*<\/span>", r"</u></b>\1"),
+    sub(r"(<\/u><\/b>)(\w+)", r"\1 \2"),
+]
+
+# Rules for english sentences
+ENGLISH_FORMATTER = Formatter(
+    # Remove tags
+    sub(r"<p>|<em>|<strong>|/$", ""),
+    sub(r"<\/p>|<\/em>|<\/strong>", ""),
+    replace("<br/>/", ""),
+    UNDERLINE_TO_BOLD_UNDERLINE,
+    # Remove extra whitespace
+    replace("  ", " "),
+    replace("\n", " "),
+    # Add full stop if necessary
+    sub(r"(\w+)\Z", r"\1.\'"),
+    sub(r"(<\/u><\/b>)\Z", r"\1."),
+    strip(),
+)
 
-def download_file(url):
-    """ Download file from URL """
+# Rules for portuguese sentences
+PORTUGUESE_FORMATTER = Formatter(
+    # Remove tags
+    sub(r"<(\/)*p>|<(\/)*em>|<(\/)*strong>", ""),
+    sub(r"(<br(\/)*>(\/)*)", ""),
+    UNDERLINE_TO_BOLD_UNDERLINE,
+    # Remove extra whitespace
+    replace("  ", " "),
+    ADD_FULL_STOP_IGNORING_WHITESPACE,
+    strip(),
+)
 
-    local_filename = url.split("/")[-1]
-    with requests.get(url, stream=True) as r:
-        with open(f"audios/{local_filename}", "wb") as f:
-            shutil.copyfileobj(r.raw, f)
 
-    return local_filename
+def format_english_text(text):
+    return ENGLISH_FORMATTER.format(text)
 
 
-def format_english_text(text):
-    # print(text)
+def format_portuguese_text(text):
+    return PORTUGUESE_FORMATTER.format(text)
 
-    # Remove tags
-    text = re.sub(r"<p>|<em>|<strong>|/$", "", text)
-    text = re.sub(r"<\/p>|<\/em>|<\/strong>", "", text)
-    text = re.sub(r"(<br\/>\/)", "", text)
-
-    # Replace <span> tag with bold and underline
-    # print(text)
-    text = re.sub(r"<u>\s*", "<b><u>", text)
-    text = re.sub(r"(\W*)\s*<\/u>", r"</u></b>\1", text)
-    text = re.sub(r"<span style=\"text-decoration: underline;\">\s*", "<b><u>", text)
-    text = re.sub(r"(\W*)\s*<\/span>", r"</u></b>\1", text)
-    text = re.sub(r"(<\/u><\/b>)(\w+)", r"\1 \2", text)
 
-    # Remove extra whitespace
-    text = text.replace("  ", " ")
-    text = text.replace("\n", " ")
+def audio_url(audio):
+    """ Returns an <audio> tag's URL. Older posts link to it with an <a> tag instead of a src attribute """
 
-    # Add full stop if necessary
-    text = re.sub(r"(\w+)\Z", r"\1.\'", text)
-    text = re.sub(r"(<\/u><\/b>)\Z", r"\1.", text)
+    if audio.get("src"):
+        return audio["src"]
+    link = audio.find("a", href=True)
+    return link["href"] if link else None
 
-    return text.strip()
 
+def extract_cards(html, timeBudget=10.0):
+    """ Walks a post's body once, pairing each sentence paragraph (english, <br>, portuguese) with the
+    audio that follows it. Returns aligned (english, portuguese, audio URL) triples, unformatted, and
+    whether the whole body was walked: it stops early if that takes longer than timeBudget seconds """
 
-def format_portuguese_text(text):
-    # Remove tags
-    text = re.sub(r"<(\/)*p>|<(\/)*em>|<(\/)*strong>", "", text)
-    text = re.sub(r"(<br(\/)*>(\/)*)", "", text)
+    start = time.perf_counter()
+    body = html.find("div", class_="td-post-content") or html
 
-    # Replace tags with bold and underline
-    text = re.sub(r"<u>\s*", "<b><u>", text)
-    text = re.sub(r"(\W*)\s*<\/u>", r"</u></b>\1", text)
-    text = re.sub(r"<span style=\"text-decoration: underline;\">\s*", "<b><u>", text)
-    text = re.sub(r"(\W*)\s*<\/span>", r"</u></b>\1", text)
-    text = re.sub(r"(<\/u><\/b>)(\w+)", r"\1 \2", text)
+    cards = list()
+    pending = None  # (english, portuguese) waiting for its audio
+    for element in body.find_all(["p", "audio"]):
+        if time.perf_counter() - start > timeBudget:
+            print(f"Time budget of {timeBudget}s exceeded. Keeping the {len(cards)} cards found so far.")
+            return cards, False
 
-    # Remove extra whitespace
-    text = text.replace("  ", " ")
+        if element.name == "audio":
+            url = audio_url(element)
+            if pending is not None and url:
+                cards.append((*pending, url))
+            pending = None
+            continue
 
-    # Add full stop if necessary
-    text = re.sub(r"(\w+)\s*\Z", r"\1.", text)
-    text = re.sub(r"(<\/u><\/b>)\s*\Z", r"\1.", text)
-
-    return text.strip()
-
-
-def post_to_card(targetPost):
-    name = targetPost.split("/")[3]
-    with open(f"csv/{name}.csv", "w+", encoding="utf8") as card:
-        englishSentences = list()
-        audiosURLs = list()
-        audiosFilenames = list()
-
-        headers = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
-        }
-        req = requests.get(targetPost, headers=headers)
-        if req.status_code == 200:
-            print("Successful GET request!")
-
-            # Retrieve HTML content
-            content = req.content
-            html = BeautifulSoup(content, "html.parser")
-
-            # Extract english sentences
-            englishSentences = [
-                "".join(x)
-                for x in re.findall(r"(?:<p.*?>)(.*?)(?:<br\s*(\/)*>)/?", str(html))
-            ]
-            englishSentences = list(map(format_english_text, englishSentences))
-            # print(englishSentences)
-
-            # Extract portuguese sentences
-            portugueseSentences = re.findall(
-                r"(?<!em>.)(<br\s*\/*\s*>\s*\n*.*)", str(html)
-            )
-            portugueseSentences = list(map(format_portuguese_text, portugueseSentences))
-            # print(portugueseSentences)
-
-            # Extract audios URLs and downloading audios
-            try:
-                for p in html.select("audio"):
-                    print(f"Downloading {p['src']}")
-                    # localFilename = download_file(p['src'])
-                    audiosURLs.append(p["src"])
-            except KeyError:  # Due to older posts html configuration
-                for audio in html.find_all("audio", class_="wp-audio-shortcode"):
-                    for a in audio.find_all("a"):
-                        audiosURLs.append(a["href"])
-
-            # Ignore empty entries
-            try:
-                englishSentences.remove("")
-            except ValueError:
-                pass
-            try:
-                portugueseSentences.remove("")
-            except ValueError:
-                pass
-            try:
-                audiosURLs.remove("")
-            except ValueError:
-                pass
-
-            print(len(englishSentences), len(portugueseSentences), len(audiosURLs))
-            # Try to adjust uneven lists
-            while len(englishSentences) != len(audiosURLs) or len(audiosURLs) != len(
-                portugueseSentences
-            ):
-                print(
-                    f"Lists don't have all the same length. Output may be compromised. {len(englishSentences)} english sentences, {len(portugueseSentences)} portuguese sentences, {len(audiosURLs)} audio files."
-                )
-                if len(englishSentences) > len(audiosURLs):
-                    englishSentences = englishSentences[1:]
-                elif len(portugueseSentences) > len(audiosURLs):
-                    portugueseSentences = portugueseSentences[1:]
-                else:
-                    audiosURLs = audiosURLs[1:]
-                failedLogger.error(targetPost)
-
-            # Get every third sentence (adjusting this will get more or less sentences from the page)
-            englishSentences = englishSentences[0:-1:3]
-            portugueseSentences = portugueseSentences[0:-1:3]
-            audiosURLs = audiosURLs[0:-1:3]
-
-            # Download audio files
-            for audioFilename in audiosURLs:
-                print(f"Downloading {audioFilename}")
-                audiosFilenames.append(download_file(audioFilename))
-
-            # Write data to CSV
-            for i in range(0, len(englishSentences)):
-                try:
-                    card.write(
-                        f"{englishSentences[i]}^{portugueseSentences[i]}^[sound:{audiosFilenames[i]}]^english_mairo\n"
-                    )
-                except IndexError:
-                    print(f"Failed writing data do CSV.")
-                    pass
-        else:
-            print("Failed GET request.")
+        # Sentence paragraphs have the english sentence, a <br> and the portuguese sentence
+        br = element.find("br", recursive=False)
+        if br is None:
+            continue
+        children = element.contents
+        split = children.index(br)
+        english = "".join(map(str, children[:split]))
+        portuguese = "".join(map(str, children[split + 1 :]))
+        pending = (english, portuguese)
+
+    return cards, True
+
+
+def fetch_post(targetPost):
+    """ GETs a post. Returns its HTML content, or None if the request failed """
+
+    headers = {
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
+    }
+    req = cached_get(targetPost, headers=headers)
+    if req.status_code != 200:
+        print("Failed GET request.")
+        return None
+    print("Successful GET request!")
+    return req.content
+
+
+def parse_post(targetPost, content, timeBudget=10.0):
+    """ Extracts every third card of a post. Returns formatted (english, portuguese, audio URL) triples """
+
+    html = BeautifulSoup(content, "html.parser")
+
+    # Extract (english, portuguese, audio) triples from the post body
+    cards, finished = extract_cards(html, timeBudget)
+    if not finished:
+        failedLogger.error(targetPost)
+    if not cards:
+        print("No sentences found.")
+        failedLogger.error(targetPost)
+        return []
+
+    # Get every third card (adjusting this will get more or less sentences from the page)
+    cards = cards[0:-1:3]
+
+    englishSentences = ENGLISH_FORMATTER.format_all(card[0] for card in cards)
+    portugueseSentences = PORTUGUESE_FORMATTER.format_all(card[1] for card in cards)
+    return list(zip(englishSentences, portugueseSentences, (card[2] for card in cards)))
+
+
+def download_audios(cards):
+    """ Downloads the audios of (english, portuguese, audio URL) cards, in parallel. Returns the cards
+    whose audio was downloaded, with its filename instead of its URL """
+
+    for _, _, url in cards:
+        print(f"Downloading {url}")
+    audiosFilenames = download_files(card[2] for card in cards)
+
+    # Drop only the cards whose audio failed to download; a later run can claim them again
+    release_sentences(card[0] for card, filename in zip(cards, audiosFilenames) if filename is None)
+    return [
+        (english, portuguese, filename)
+        for (english, portuguese, _), filename in zip(cards, audiosFilenames)
+        if filename is not None
+    ]
+
+
+def export_cards(cards):
+    # Write data to CSV
+    get_sink("csv", "mairo_vergara", "^").write_cards(
+        [english, portuguese, f"[sound:{filename}]", "english_mairo"] for english, portuguese, filename in cards
+    )
+
+
+def post_to_card(targetPost, timeBudget=10.0):
+    """ Scraps a post for its aligned english sentences, portuguese sentences and audios,
+    downloading every third card's audio and writing it to the export sink """
+
+    content = fetch_post(targetPost)
+    if content is None:
+        return
+
+    with metrics.stage("parse"):
+        cards = parse_post(targetPost, content, timeBudget)
+    # Skip cards whose sentence was already kept from another post, source or run
+    cards = claim_cards(cards, "mairo_vergara")
+
+    try:
+        export_cards(download_audios(cards))
+    except BaseException:
+        # The cards were not exported: let a later run claim their sentences again
+        release_sentences(card[0] for card in cards)
+        raise
 
 
 def scrap_page(targetPage):
@@ -199,6 +227,10 @@ def scrap_pages_txt(txtFilePath):
     for page in pages:
         post_to_card(page[:-1])  # Remove '\n' from string
 
+    # Merge every scraped card into csv/mairo_vergara_anki.txt
+    get_sink("csv", "mairo_vergara", "^").flush()
+    merge_shards("csv", "mairo_vergara", separator="^")
+
 
 if __name__ == "__main__":
     # Logger for debugging purposes; logging HTTPS requests, etc
@@ -211,8 +243,6 @@ if __name__ == "__main__":
     logging.FileHandler("requests.log", mode="w")
 
     # Logger for failed parsings
-    failedLogger = logging.getLogger("failed")
-    failedLogger.setLevel(logging.ERROR)
     failedLogger_file_handler = logging.FileHandler("failed.log")
     failedLogger_file_handler.setLevel(logging.ERROR)
     failedLogger.addHandler(failedLogger_file_handler)
@@ -0,0 +1,63 @@
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import metrics
+from common.http_cache import cached_get_async
+
+
+async def _fetch_worker(session, urls, handlePage, loop, executor):
+    """ Fetches URLs from the shared iterator until it is exhausted, handing each page to handlePage.
+    Pages go through the shared HTTP cache, like with cached_get() """
+
+    for url in urls:
+        try:
+            response = await cached_get_async(session, url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed GET request for {url}: {e}")
+            metrics.count("fetch_errors")
+            continue
+        statusCode, content = response.status_code, response.content
+
+        # Parsing (and WaveNet calls) are blocking, so run them off the event loop
+        try:
+            await loop.run_in_executor(executor, handlePage, url, statusCode, content)
+        except Exception as e:
+            print(f"Failed handling {url}: {e}")
+
+
+async def fetch_all(
+    urls, handlePage, headers=None, maxConcurrency=100, maxPerHost=20, handlerThreads=None, timeout=60
+):
+    """ Fetches all URLs concurrently over a single pooled keep-alive session.
+
+        Up to `maxConcurrency` pages are in flight at once (at most `maxPerHost` per host).
+        Each response is passed to `handlePage(url, statusCode, content)` as soon as it arrives.
+    """
+
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=maxConcurrency, limit_per_host=maxPerHost)
+    clientTimeout = aiohttp.ClientTimeout(total=timeout)
+
+    # Every worker pulls from the same iterator, so no URL is fetched twice
+    urls = iter(urls)
+    with ThreadPoolExecutor(handlerThreads) as executor:
+        async with aiohttp.ClientSession(
+            connector=connector, headers=headers, timeout=clientTimeout
+        ) as session:
+            workers = [
+                _fetch_worker(session, urls, handlePage, loop, executor)
+                for _ in range(maxConcurrency)
+            ]
+            await asyncio.gather(*workers)
+
+
+def fetch_pages(urls, handlePage, **kwargs):
+    """ Blocking wrapper around fetch_all, for use from regular (non-async) code """
+
+    asyncio.run(fetch_all(urls, handlePage, **kwargs))
@@ -1,73 +1,168 @@
 import csv
 import os
+import sys
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
 import urllib.parse
 from bs4 import BeautifulSoup
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import cached_get
+from common.json_journal import JournaledJSON
+from common.rate_limit import TokenBucket
+from common.metrics import metrics
+
+# Reverso requires user-agent, otherwise it will refuse the request
+HEADERS = {
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
+}
+
+
+def parse_top(targetURL, content, onlyNames=False, ranking=False):
+    """ Extracts links (or names) from a top list or ranking page's content, saving them to crawled/txt/ """
+
+    path = urllib.parse.urlparse(targetURL).path
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    os.makedirs('crawled/txt/', exist_ok=True)
+    with open(f"crawled/txt/crawl_{name}.txt", "w+", encoding="utf-8") as crawl:
+        # Extract the HTML content from the URL for parsing
+        html = BeautifulSoup(content, "html.parser")
+
+        topListDiv = html.find("div", class_="top_list")
+        links = topListDiv.find_all("a")
+
+        # Ex: /index/frances-portugues/w.html
+        if ranking:
+            hrefs = [link["href"] for link in links]
+        else:  # Ex: /index/frances-portugues/w-1-300.html
+            # top lists have 'In Simon we trust' unwanted URL (easter egg?)
+            hrefs = [link["href"] for link in links[:-1]]
+
+
+        if onlyNames:
+            extracted_names = [link.text for link in links]
+            for name in extracted_names:
+                crawl.write(f"{name}\n")
+            return extracted_names
+        else:
+            for href in hrefs:
+                crawl.write(f"{href}\n")
+            return hrefs
+
+
 def crawl_top(targetURL, onlyNames=False, ranking=False):
     """ Crawls top list or ranking page looking for links to target words/expressions """
 
-    # Reverso requires user-agent, otherwise it will refuse the request
-    headers = {
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
-    }
+    with metrics.stage("crawl_top"):
+        req = cached_get(targetURL, headers=HEADERS)
+        if req.status_code == 200:
+            print("Successful GET request!")
+            return parse_top(targetURL, req.content, onlyNames, ranking)
 
-    req = requests.get(targetURL, headers=headers)
-    if req.status_code == 200:
-        path = urllib.parse.urlparse(targetURL).path
-        name = os.path.splitext(os.path.basename(path))[0]
 
-        os.makedirs('crawled/txt/', exist_ok=True)
-        with open(f"crawled/txt/crawl_{name}.txt", "w+", encoding="utf-8") as crawl:
-            print("Successful GET request!")
+def write_subranking_csv(ranking_url, names):
+    """ Writes the names found on a ranking page, with their Reverso URLs, to crawled/csv/<subranking>.csv """
 
-            # Extract the HTML content from the URL for parsing
-            content = req.content
-            html = BeautifulSoup(content, "html.parser")
+    # Extract subranking identifier from the URL
+    subranking = ranking_url.split('/')[-1].split('.')[0]  # e.g. p-401-800
+    # Create a CSV file for this subranking
+    with open(f'crawled/csv/{subranking}.csv', 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Name', 'URL'])  # CSV header
 
-            topListDiv = html.find("div", class_="top_list")
-            links = topListDiv.find_all("a")
+        for name in names:
+            # Build Reverso URL for each name
+            name_url = f"https://context.reverso.net/traducao/frances-portugues/{urllib.parse.quote(name)}"
+            writer.writerow([name, name_url])
+    print(f"Finished crawling {subranking}")
 
-            # Ex: /index/frances-portugues/w.html
-            if ranking:
-                hrefs = [link["href"] for link in links]
-            else:  # Ex: /index/frances-portugues/w-1-300.html
-                # top lists have 'In Simon we trust' unwanted URL (easter egg?)
-                hrefs = [link["href"] for link in links[:-1]]
 
+def crawl_all(type = 'p', refresh=False, workers=1, requestsPerSecond=2):
+    """ Crawls every ranking page of a letter index into crawled/csv/.
 
-            if onlyNames:
-                extracted_names = [link.text for link in links]
-                for name in extracted_names:
-                    crawl.write(f"{name}\n")
-                return extracted_names
-            else:
-                for href in hrefs:
-                    crawl.write(f"{href}\n")
-                return hrefs
+    Progress is kept in crawled/frontier_<type>.json: each ranking page is pending, done or
+    failed, with the hash of its content. A new run resumes from the pages that are not done yet.
+    With refresh=True, done pages are fetched again, but their CSV is only rewritten if the
+    page changed.
 
+    With workers > 1, ranking pages are fetched in parallel over the shared pooled session,
+    never faster than requestsPerSecond, and each CSV is written as soon as its page arrives.
+    """
 
-def crawl_all(type = 'p'):
     base_url = f"https://context.reverso.net/traducao/index/frances-portugues/{type}.html"
 
-    # First, get the URLs for the ranking pages
-    ranking_urls = crawl_top(base_url, ranking=True)
-
-    # Then, iterate over the ranking pages and get the names on each page
     os.makedirs('crawled/csv', exist_ok=True)
-    for ranking_url in ranking_urls:
-        names = crawl_top(ranking_url, onlyNames=True, ranking=False)
-
-        # Extract subranking identifier from the URL
-        subranking = ranking_url.split('/')[-1].split('.')[0]  # e.g. p-401-800
-        # Create a CSV file for this subranking
-        with open(f'crawled/csv/{subranking}.csv', 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Name', 'URL'])  # CSV header
-
-            for name in names:
-                # Build Reverso URL for each name
-                name_url = f"https://context.reverso.net/traducao/frances-portugues/{urllib.parse.quote(name)}"
-                writer.writerow([name, name_url])
-            print(f"Finished crawling {subranking}")
+    frontier = JournaledJSON(f'crawled/frontier_{type}.json', batchSize=1, compactEvery=100)
+
+    try:
+        # First, get the URLs for the ranking pages
+        ranking_urls = crawl_top(base_url, ranking=True)
+        if ranking_urls is None:
+            print(f"Failed to get the ranking pages of {base_url}.")
+            return
+
+        for ranking_url in ranking_urls:
+            if ranking_url not in frontier:
+                frontier.set(ranking_url, {"status": "pending", "hash": None})
+
+        # Then, get the names on each ranking page that still needs crawling
+        pending_urls = [
+            ranking_url
+            for ranking_url in ranking_urls
+            if frontier[ranking_url]["status"] != "done" or refresh
+        ]
+
+        # Politeness cap: at most requestsPerSecond requests, whatever the number of workers.
+        # A capacity of 1 means no burst, not even when the crawl starts
+        limiter = TokenBucket(requestsPerSecond, capacity=1)
+
+        def fetch_ranking(ranking_url):
+            limiter.acquire()
+            return cached_get(ranking_url, headers=HEADERS)
+
+        with ThreadPoolExecutor(workers) as executor:
+            future_to_url = {
+                executor.submit(fetch_ranking, ranking_url): ranking_url
+                for ranking_url in pending_urls
+            }
+
+            # Write each subranking as soon as its page arrives, whatever the order
+            for future in as_completed(future_to_url):
+                ranking_url = future_to_url[future]
+                try:
+                    req = future.result()
+                except Exception as e:
+                    print(f"Failed GET request for {ranking_url}: {e}")
+                    frontier.set(ranking_url, {"status": "failed", "hash": frontier[ranking_url]["hash"]})
+                    continue
+
+                try:
+                    save_ranking(frontier, ranking_url, req)
+                except Exception as e:
+                    # A page that can't be parsed is retried on the next run; keep crawling the others
+                    print(f"Failed parsing {ranking_url}: {e}")
+                    frontier.set(ranking_url, {"status": "failed", "hash": frontier[ranking_url]["hash"]})
+    finally:
+        frontier.close()
+
+
+def save_ranking(frontier, ranking_url, req):
+    """ Writes a fetched ranking page's CSV and records the result in the crawl frontier """
+
+    entry = frontier[ranking_url]
+    if req.status_code != 200:
+        print(f"Failed GET request for {ranking_url}.")
+        frontier.set(ranking_url, {"status": "failed", "hash": entry["hash"]})
+        return
+
+    contentHash = hashlib.sha256(req.content).hexdigest()
+    if entry["status"] == "done" and contentHash == entry["hash"]:
+        print(f"{ranking_url} didn't change. Skipping it...")
+        return
+
+    names = parse_top(ranking_url, req.content, onlyNames=True, ranking=False)
+    write_subranking_csv(ranking_url, names)
+    frontier.set(ranking_url, {"status": "done", "hash": contentHash})
@@ -5,6 +5,19 @@ import json
 os.environ["GOOGLE_API_KEY"] = # Insert your API key here
 os.environ["FRENCH_SEARCH_ENGINE_ID"] = # Insert your search engine ID here
 
+
+class CustomSearchError(Exception):
+    """ Raised when the Custom Search API answers with a non-200 status code """
+
+    def __init__(self, status_code):
+        super().__init__(f"Request to Google Custom Search API failed with status code {status_code}")
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        # Rate limiting and server-side errors are worth retrying; anything else is not
+        return self.status_code == 429 or self.status_code >= 500
+
 def google_search(search_term):
     # Get API key and search engine ID from environment variables
     api_key = os.getenv("GOOGLE_API_KEY")
@@ -26,7 +39,7 @@ def google_search(search_term):
 
     # Raise an exception if the request was unsuccessful
     if response.status_code != 200:
-        raise Exception(f"Request to Google Custom Search API failed with status code {response.status_code}")
+        raise CustomSearchError(response.status_code)
 
     # Parse JSON response
     data = json.loads(response.text)
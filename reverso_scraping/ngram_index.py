@@ -0,0 +1,214 @@
+""" Offline n-gram frequency index, built once from a local text corpus.
+
+The index file is a small header followed by (n-gram hash, count) records sorted by hash, so it
+can be memory-mapped and queried with a binary search without loading it. It stands in for
+custom_search.get_total_results when ranking phrases by frequency. Usage:
+
+    python ngram_index.py build corpus.txt ngrams.idx [--max-n 5]
+    python ngram_index.py query ngrams.idx "dans le pétrin" "avoir la flemme"
+"""
+
+import os
+import re
+import mmap
+import heapq
+import struct
+import hashlib
+import argparse
+import tempfile
+import collections
+
+MAGIC = b"NGRAMIDX"
+# Magic, format version, maximum n-gram length, number of records
+HEADER = struct.Struct("<8sIIQ")
+# N-gram hash, count
+RECORD = struct.Struct("<QQ")
+
+# Words, keeping letters with diacritics; apostrophes and hyphens split words ("l'homme" -> "l", "homme")
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower())
+
+
+def ngram_key(tokens):
+    """ 64-bit hash of an n-gram. Only hashes are stored, which keeps records a fixed 16 bytes """
+
+    return int.from_bytes(
+        hashlib.blake2b(" ".join(tokens).encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def _write_records(path, records, maxN):
+    """ Writes sorted (key, count) records to path, with the index header """
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 1, maxN, 0))
+        written = 0
+        for key, value in records:
+            f.write(RECORD.pack(key, value))
+            written += 1
+        # Fill in the number of records now that it is known
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, 1, maxN, written))
+    return written
+
+
+def _read_records(path):
+    with open(path, "rb") as f:
+        f.seek(HEADER.size)
+        while True:
+            chunk = f.read(RECORD.size * 4096)
+            if not chunk:
+                break
+            yield from RECORD.iter_unpack(chunk)
+
+
+def _merge_runs(runPaths):
+    """ Merges sorted runs into a single sorted stream, adding up the counts of equal keys """
+
+    currentKey, currentCount = None, 0
+    for key, count in heapq.merge(*map(_read_records, runPaths)):
+        if key == currentKey:
+            currentCount += count
+            continue
+        if currentKey is not None:
+            yield currentKey, currentCount
+        currentKey, currentCount = key, count
+    if currentKey is not None:
+        yield currentKey, currentCount
+
+
+def build_index(corpusPath, indexPath, maxN=5, minCount=1, maxEntriesInMemory=5_000_000):
+    """ Counts every n-gram of 1 to maxN words of a text corpus into an index file.
+
+    Counts are kept in memory until there are maxEntriesInMemory distinct n-grams, then written
+    as a sorted run to a temporary file; runs are merged at the end, so corpora much larger than
+    memory can be indexed. N-grams seen less than minCount times are left out of the index.
+    """
+
+    counts = collections.Counter()
+    runPaths = list()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(indexPath))) as runsDirectory:
+        with open(corpusPath, "r", encoding="utf-8", errors="replace") as corpus:
+            for lineNumber, line in enumerate(corpus, 1):
+                tokens = tokenize(line)
+                for n in range(1, maxN + 1):
+                    for i in range(len(tokens) - n + 1):
+                        counts[ngram_key(tokens[i : i + n])] += 1
+
+                if len(counts) >= maxEntriesInMemory:
+                    runPaths.append(os.path.join(runsDirectory, f"run-{len(runPaths)}.idx"))
+                    _write_records(runPaths[-1], sorted(counts.items()), maxN)
+                    counts.clear()
+                    print(f"{lineNumber} lines read, {len(runPaths)} runs written.")
+
+        if runPaths:
+            runPaths.append(os.path.join(runsDirectory, f"run-{len(runPaths)}.idx"))
+            _write_records(runPaths[-1], sorted(counts.items()), maxN)
+            counts.clear()
+            records = _merge_runs(runPaths)
+        else:
+            records = sorted(counts.items())
+
+        # Write to a temporary file and rename, so readers never see a partial index
+        written = _write_records(
+            f"{indexPath}.tmp",
+            ((key, count) for key, count in records if count >= minCount),
+            maxN,
+        )
+        os.replace(f"{indexPath}.tmp", indexPath)
+
+    print(f"Indexed {written} n-grams into {indexPath}.")
+    return written
+
+
+class NgramIndex:
+    """ Read-only, memory-mapped view of an index built by build_index() """
+
+    def __init__(self, indexPath):
+        self._file = open(indexPath, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.maxN, self.size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != 1:
+            raise ValueError(f"{indexPath} is not an n-gram index.")
+
+    def _find(self, key, lo=0):
+        """ Binary search for key among records lo..size. Returns (count, insertion position) """
+
+        hi = self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            midKey, midCount = RECORD.unpack_from(self._mmap, HEADER.size + mid * RECORD.size)
+            if midKey < key:
+                lo = mid + 1
+            elif midKey > key:
+                hi = mid
+            else:
+                return midCount, mid
+        return 0, lo
+
+    def count(self, phrase):
+        """ Returns how many times phrase appears in the corpus, or None if it has more than maxN words """
+
+        tokens = tokenize(phrase)
+        if not tokens or len(tokens) > self.maxN:
+            return None
+        return self._find(ngram_key(tokens))[0]
+
+    def counts(self, phrases):
+        """ Returns {phrase: count} for many phrases at once (None for phrases longer than maxN words).
+        Lookups are done in hash order, so each binary search starts where the previous one ended """
+
+        keys = dict()
+        results = dict()
+        for phrase in phrases:
+            tokens = tokenize(phrase)
+            if not tokens or len(tokens) > self.maxN:
+                results[phrase] = None
+            else:
+                keys[phrase] = ngram_key(tokens)
+
+        position = 0
+        for phrase, key in sorted(keys.items(), key=lambda item: item[1]):
+            results[phrase], position = self._find(key, position)
+        return results
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline n-gram frequency index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="index a text corpus (one or more sentences per line)")
+    build.add_argument("corpus")
+    build.add_argument("index")
+    build.add_argument("--max-n", type=int, default=5, help="longest n-gram indexed, in words")
+    build.add_argument("--min-count", type=int, default=1, help="leave out rarer n-grams")
+
+    query = commands.add_parser("query", help="print the counts of phrases")
+    query.add_argument("index")
+    query.add_argument("phrases", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.corpus, args.index, args.max_n, args.min_count)
+    else:
+        with NgramIndex(args.index) as index:
+            for phrase, count in index.counts(args.phrases).items():
+                print(f"{phrase}\t{count}")
+
+
+if __name__ == "__main__":
+    main()
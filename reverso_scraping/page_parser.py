@@ -0,0 +1,155 @@
+import re
+import math
+import heapq
+import collections
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from str_utils import TARGET_LANGUAGE_FORMATTER, NATIVE_LANGUAGE_FORMATTER
+from common.metrics import metrics
+
+# Words of a sentence, for scoring
+WORD_REGEX = re.compile(r"\w+")
+
+
+def example_pairs_strainer(targetLanguage):
+    """ Returns a SoupStrainer that keeps only the elements holding example sentences """
+
+    lang = targetLanguage[:2].lower()
+
+    def is_example_element(name, attrs):
+        if name == "span":
+            return attrs.get("lang") == lang
+        if name == "div":
+            classes = attrs.get("class")
+            if isinstance(classes, list):
+                classes = " ".join(classes)
+            return classes == "trg ltr"
+        return False
+
+    return SoupStrainer(is_example_element)
+
+
+# A sentence pair found on a page: its plain texts, used for scoring, and its markup, used for formatting
+Candidate = collections.namedtuple("Candidate", ["targetText", "nativeText", "targetMarkup", "nativeMarkup"])
+
+
+# Scores are computed for all candidates of a page at once, and lower scores are better.
+# A score function takes the list of candidates and returns one number per candidate
+
+
+def by_length(candidates):
+    """ Shorter targetLanguage sentences first (they usually have better quality) """
+
+    return [len(candidate.targetText) for candidate in candidates]
+
+
+def by_word_rarity(wordFrequencies):
+    """ Returns a score function preferring sentences made of frequent words, given {word: frequency} """
+
+    def score(candidates):
+        scores = list()
+        for candidate in candidates:
+            words = WORD_REGEX.findall(candidate.targetText.lower())
+            rarities = [1 / math.log(2 + wordFrequencies.get(word, 0)) for word in words]
+            scores.append(sum(rarities) / len(rarities) if rarities else 1)
+        return scores
+
+    return score
+
+
+def by_keyword_position(candidates):
+    """ Sentences whose highlighted keyword comes early first, as a fraction of the sentence length """
+
+    scores = list()
+    for candidate in candidates:
+        position = candidate.targetMarkup.find("<em>")
+        scores.append(position / len(candidate.targetMarkup) if position >= 0 else 1)
+    return scores
+
+
+def weighted(*weightedScores):
+    """ Returns a score function adding up (weight, score function) pairs, e.g.
+    weighted((1, by_length), (50, by_keyword_position)) """
+
+    def score(candidates):
+        total = [0] * len(candidates)
+        for weight, scoreFunction in weightedScores:
+            total = [t + weight * s for t, s in zip(total, scoreFunction(candidates))]
+        return total
+
+    return score
+
+
+def select_cards(candidates, k=6, score=by_length, maxLength=140):
+    """ Returns the formatted (targetLanguage, nativeLanguage) pairs of the k best scored candidates.
+
+    Candidates whose plain text is already longer than maxLength are dropped before scoring or
+    formatting. The others are kept in a heap and only formatted as they are popped, best first;
+    a pair that is still too long once formatted is replaced by the next best candidate, so k
+    cards are returned whenever k good candidates exist.
+    """
+
+    candidates = [
+        candidate
+        for candidate in candidates
+        if len(candidate.targetText) <= maxLength and len(candidate.nativeText) <= maxLength
+    ]
+    if not candidates:
+        return list()
+
+    # Ties keep page order, like a stable sort would
+    heap = list(zip(score(candidates), range(len(candidates))))
+    heapq.heapify(heap)
+
+    cards = list()
+    with metrics.stage("format"):
+        while heap and len(cards) < k:
+            _, index = heapq.heappop(heap)
+            targetLanguageSentence = TARGET_LANGUAGE_FORMATTER.format(candidates[index].targetMarkup)
+            nativeLanguageSentence = NATIVE_LANGUAGE_FORMATTER.format(candidates[index].nativeMarkup)
+
+            # Long sentences are hardly useful for studying. Remove this if you want them.
+            if len(targetLanguageSentence) > maxLength or len(nativeLanguageSentence) > maxLength:
+                print("Sentence is too long. Skipping it...")
+                continue
+            cards.append((targetLanguageSentence, nativeLanguageSentence))
+
+    return cards
+
+
+def parse_page_cards(content, targetLanguage, k=6, score=by_length):
+    """ Extracts and formats the k best (targetLanguage, nativeLanguage) sentence pairs from a Reverso page's HTML content """
+
+    with metrics.stage("parse"):
+        # Extract the HTML content from the URL for parsing.
+        # Only the example sentences are kept, so the rest of the page never becomes a tree
+        html = BeautifulSoup(content, "lxml", parse_only=example_pairs_strainer(targetLanguage))
+
+        # Extract raw targetLanguage sentences
+        rawTargetLanguageSentences = html.find_all(
+            "span", lang=targetLanguage[:2].lower()
+        )
+        # Extract raw nativeLanguage sentences
+        rawNativeLanguageSentences = html.find_all("div", class_="trg ltr")
+
+        if len(rawTargetLanguageSentences) != len(rawNativeLanguageSentences):  # If parsing fails
+            print(
+                f"Lists don't have all the same length. Output may be compromised.\n{len(rawTargetLanguageSentences)}, {len(rawNativeLanguageSentences)}"
+            )
+
+        candidates = list()
+        for targetLanguageElement, nativeLanguageElement in zip(
+            rawTargetLanguageSentences, rawNativeLanguageSentences
+        ):
+            nativeLanguageText = nativeLanguageElement.find("span", class_="text")
+            candidates.append(
+                Candidate(
+                    targetLanguageElement.text,
+                    nativeLanguageText.text,
+                    "".join(map(str, targetLanguageElement.contents)),
+                    "".join(map(str, nativeLanguageText.contents)),
+                )
+            )
+
+    return select_cards(candidates, k, score)
@@ -1,19 +1,29 @@
-import time
 import json
 import os
+import sys
 import glob
 import csv
-import urllib.parse
 import functools
-import requests
-from bs4 import BeautifulSoup
 from google.cloud import texttospeech
-from wavenet import generate_audio_random, get_modified_path
+from wavenet import generate_audio_random, audio_filename, load_voice_catalog, audio_cache
 from multiprocessing import Pool, cpu_count
-
-from str_utils import format_target_language_sentence, format_native_language_sentence, create_prompt
+from async_fetch import fetch_pages
+
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tts_stage import TTSStage
+from common.http_cache import cached_get
+from common.json_journal import JournaledJSON
+from common.json_stream import iter_json_object, iter_json_lines, JSONObjectWriter, JSONLinesJournal, merge_json_lines, stream_update
+from common.export import get_sink, merge_shards
+from common.dedup import claim_sentence, release_sentences
+from common.rate_limit import TokenBucket, AdaptiveTokenBucket, call_with_retries
+
+from str_utils import create_prompt, strip_markup
+from page_parser import parse_page_cards
 from crawl import crawl_top, crawl_all
-from custom_search import get_total_results
+from custom_search import get_total_results, CustomSearchError
+from ngram_index import NgramIndex
 from utils import sort_json_file
 from dotenv import load_dotenv
 import openai
@@ -24,91 +34,68 @@ load_dotenv()
 # Get the API key
 openai.api_key = os.getenv('OPENAI_APIKEY')
 
-def scrap_page(targetURL, audiosPath, targetLanguage):
-    """ Scraps a single URL for sentences and generates audios using WaveNet """
+# Reverso requires user-agent, otherwise it will refuse the request
+HEADERS = {
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
+}
 
-    # Save the word/expression from URL to use as .csv file name
-    name = urllib.parse.unquote(targetURL.split("/")[5])  # [:-1]
-    with open(f"csv/{name}.csv", "w+", encoding="utf-8") as card:
-        # Reverso requires user-agent, otherwise it will refuse the request
-        headers = {
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.87 Safari/537.36"
-        }
-
-        req = requests.get(targetURL, headers=headers)
-        if req.status_code == 200:
-            print("Successful GET request!")
-
-            # Initialize lists for later appending
-            audiosFilenames = list()
-            targetLanguageSentences = list()
-            nativeLanguageSentences = list()
-
-            # Extract the HTML content from the URL for parsing
-            content = req.content
-            html = BeautifulSoup(content, "html.parser")
-
-            # Extract raw targetLanguage sentences
-            rawTargetLanguageSentences = html.find_all(
-                "span", lang=targetLanguage[:2].lower()
-            )
-            # Extract raw nativeLanguage sentences
-            rawNativeLanguageSentences = html.find_all("div", class_="trg ltr")
 
-            # Zip lists so we can sort sentences by target language sentence length
-            linkedSentences = zip(
-                rawTargetLanguageSentences, rawNativeLanguageSentences
-            )
-            # Keep only the 6 shortest sentences (they usually have better quality)
-            sortedSentences = sorted(
-                linkedSentences, key=lambda elem: len(elem[0].text)
-            )[0:6]
-
-            # Clean sentences
-            for targetLanguageElement, nativeLanguageElement in sortedSentences:
-                targetLanguageSentence = format_target_language_sentence(
-                    "".join(map(str, targetLanguageElement.contents))
-                )
-
-                nativeLanguageSpan = nativeLanguageElement.find("span", class_="text")
-                nativeLanguageSentence = format_native_language_sentence(
-                    "".join(map(str, nativeLanguageSpan.contents))
-                )
-
-                # Long sentences are hardly useful for studying. Remove this if you want them.
-                if (
-                    len(targetLanguageSentence) > 140
-                    or len(nativeLanguageSentence) > 140
-                ):
-                    print("Sentence is too long. Skipping it...")
-                    continue
-                else:
-                    targetLanguageSentences.append(targetLanguageSentence)
-                    nativeLanguageSentences.append(nativeLanguageSentence)
-
-            if len(targetLanguageSentences) != len(
-                nativeLanguageSentences
-            ):  # If parsing fails
-                print(
-                    f"Lists don't have all the same length. Output may be compromised.\n{len(targetLanguageSentences)}, {len(nativeLanguageSentences)}"
-                )
-
-            cardInfos = list(zip(targetLanguageSentences, nativeLanguageSentences))
-            for i in range(
-                len(cardInfos)
-            ):  # targetLanguage sentences at index 0, nativeLanguage sentences at index 1
-                # Generate audios for targetLanguage sentences using Google's WaveNet API
-                # Strip sentence of markup so we can use it as filename (otherwise will raise FileNotFoundError exception)
-                cleanSentence = BeautifulSoup(cardInfos[i][0], "lxml").text
+def get_export_sink():
+    """ Returns this process's sink for Reverso cards (csv/shards/reverso-<pid>.txt) """
+
+    return get_sink("csv", "reverso", "\t")
+
+
+def write_page_cards(content, sink, audiosPath, targetLanguage, ttsStage=None):
+    """ Parses a Reverso page's HTML content, generates audios using WaveNet and writes cards to the export sink.
+    Sentences already in the shared de-duplication index are skipped.
+    If ttsStage is given, audios are queued on it instead of being generated before returning """
+
+    audiosFilenames = list()
+    rows = list()
+
+    claimed = list()
+
+    cardInfos = parse_page_cards(content, targetLanguage)
+    try:
+        for i in range(
+            len(cardInfos)
+        ):  # targetLanguage sentences at index 0, nativeLanguage sentences at index 1
+            # Skip sentences already kept from another page, source or run
+            if not claim_sentence(cardInfos[i][0], "reverso"):
+                continue
+            claimed.append(cardInfos[i][0])
+
+            # Generate audios for targetLanguage sentences using Google's WaveNet API
+            # Strip sentence of markup so we can use it as filename (otherwise will raise FileNotFoundError exception)
+            cleanSentence = strip_markup(cardInfos[i][0])
+            if ttsStage is None:
                 generate_audio_random(audiosPath, cleanSentence, targetLanguage)
-                audiosFilenames.append(get_modified_path(cleanSentence))
+            else:
+                ttsStage.submit(audiosPath, cleanSentence, targetLanguage)
+            audiosFilenames.append(audio_filename(cleanSentence))
 
-                # Write sentences and audios filenames to the .csv file, using TAB as separator
-                card.write(
-                    f"{cardInfos[i][0]}\t{cardInfos[i][1]}\t[sound:{audiosFilenames[-1]}.mp3]\ttargetLanguage_reverso\n"
-                )
-        else:
-            print("Failed GET request.")
+            # Sentences and audios filenames, written using TAB as separator
+            rows.append(
+                [cardInfos[i][0], cardInfos[i][1], f"[sound:{audiosFilenames[-1]}]", "targetLanguage_reverso"]
+            )
+
+        sink.write_cards(rows)
+    except BaseException:
+        # The cards were not exported: let a later run claim their sentences again
+        release_sentences(claimed)
+        raise
+
+
+def scrap_page(targetURL, audiosPath, targetLanguage, ttsStage=None):
+    """ Scraps a single URL for sentences and generates audios using WaveNet """
+
+    req = cached_get(targetURL, headers=HEADERS)
+    if req.status_code == 200:
+        print("Successful GET request!")
+        write_page_cards(req.content, get_export_sink(), audiosPath, targetLanguage, ttsStage)
+    else:
+        print("Failed GET request.")
 
 
 def scrap_pages_multithread(URLsTxtFile, audiosPath, targetLanguage):
@@ -116,6 +103,9 @@ def scrap_pages_multithread(URLsTxtFile, audiosPath, targetLanguage):
     with open(URLsTxtFile, encoding="utf-8") as file:
         pages = file.readlines()
 
+    # Make sure the voice catalog snapshot exists so workers don't all call list_voices() at once
+    load_voice_catalog()
+
     # Lower this if you don't want to use all your CPU threads
     nThreads = cpu_count()
     print(f"Running with {nThreads} threads.")
@@ -129,6 +119,9 @@ def scrap_pages_multithread(URLsTxtFile, audiosPath, targetLanguage):
                 ),
                 pages,
             )
+            # Let workers exit normally so they flush their export shards
+            p.close()
+            p.join()
         except KeyboardInterrupt:  # Press Ctrl + C to stop execution at any time
             print("Got ^C while pool mapping, terminating the pool")
             p.terminate()
@@ -137,102 +130,305 @@ def scrap_pages_multithread(URLsTxtFile, audiosPath, targetLanguage):
             p.join()
             print("Done!")
 
+    merge_shards("csv", "reverso")
 
-def process_expressions():
-    # Load sorted expressions
-    with open('frequency_marked_wikt_filtered.json', 'r', encoding='utf8') as f:
-        expressions = json.load(f)
 
-    # If the generated_prompts.json file does not exist or is empty, initialize an empty dictionary
-    if not os.path.exists("generated_prompts.json") or os.path.getsize("generated_prompts.json") == 0:
-        generated_prompts = {}
-    else:
-        with open("generated_prompts.json", "r", encoding='utf8') as file:
-            generated_prompts = json.load(file)
+def scrap_pages_pipelined(URLsTxtFile, audiosPath, targetLanguage, ttsWorkers=8, requestsPerMinute=500):
+    """ Scraps URLs listed in the .txt file one by one, while a separate pool of workers generates
+    the audios. Fetching and parsing the next page overlaps with synthesis of the previous ones """
+
+    # Load all URLs to a list
+    with open(URLsTxtFile, encoding="utf-8") as file:
+        pages = [line.strip() for line in file if line.strip()]
+
+    load_voice_catalog()
 
-    # Loop over each expression
-    for expression in expressions.keys():
-        # Check if this expression is already generated or if its key exists in the generated_prompts
-        if ("generated" in expressions[expression] and expressions[expression]["generated"]) or expression in generated_prompts:
-            continue
+    with TTSStage(
+        generate_audio_random, workers=ttsWorkers, requestsPerMinute=requestsPerMinute
+    ) as ttsStage:
+        for page in pages:
+            print(f"Scraping {page}...")
+            scrap_page(page, audiosPath, targetLanguage, ttsStage)
 
-        # Create the prompt
-        prompt = create_prompt(expression)
+    get_export_sink().flush()
+    merge_shards("csv", "reverso")
 
-        # Attempt to generate the prompt
+
+def scrap_pages_async(
+    URLsTxtFile, audiosPath, targetLanguage, maxConcurrency=100, maxPerHost=20, ttsWorkers=8, requestsPerMinute=500
+):
+    """ Scraps all URLs listed in the .txt file using asyncio instead of a process pool.
+    Keeps up to maxConcurrency pages in flight regardless of the number of CPU cores """
+
+    # Load all URLs to a list
+    with open(URLsTxtFile, encoding="utf-8") as file:
+        pages = [line.strip() for line in file if line.strip()]
+
+    print(f"Running with up to {maxConcurrency} concurrent requests ({maxPerHost} per host).")
+
+    # Load the voice catalog before handler threads start generating audios
+    load_voice_catalog()
+
+    def handle_page(targetURL, statusCode, content):
+        if statusCode != 200:
+            print("Failed GET request.")
+            return
+
+        print("Successful GET request!")
+        write_page_cards(content, get_export_sink(), audiosPath, targetLanguage, ttsStage)
+
+    with TTSStage(
+        generate_audio_random, workers=ttsWorkers, requestsPerMinute=requestsPerMinute
+    ) as ttsStage:
         try:
-            chat_completion = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}], max_tokens=220, temperature=0.8).choices[0].message.content
-            print(chat_completion)
-            generated_prompt = json.loads(chat_completion)
+            fetch_pages(
+                pages,
+                handle_page,
+                headers=HEADERS,
+                maxConcurrency=maxConcurrency,
+                maxPerHost=maxPerHost,
+            )
+        except KeyboardInterrupt:  # Press Ctrl + C to stop execution at any time
+            print("Got ^C, stopping...")
+
+    get_export_sink().flush()
+    merge_shards("csv", "reverso")
+    print(f"Audio cache: {audio_cache.stats()}")
 
-            # Save the generated prompt to the dictionary
-            generated_prompts[expression] = generated_prompt[expression]
 
-            # Mark this expression as generated
-            expressions[expression]["generated"] = True
-            print(f"Generated prompt for {expression}")
-        except Exception as e:
-            print(f"Failed to generate prompt for {expression} due to {str(e)}")
-            expressions[expression]["generated"] = False
+def estimate_tokens(promptLength, expressions, maxTokensPerExpression):
+    """ Rough token estimate of a prompt and its answer (~4 characters per token) """
 
-        # Save the updated expressions and generated prompts to files
-        with open('frequency_marked_wikt_filtered.json', 'w', encoding='utf8') as f:
-            json.dump(expressions, f, ensure_ascii=False, indent=4)
-        with open('generated_prompts.json', 'w', encoding='utf8') as f:
-            json.dump(generated_prompts, f, ensure_ascii=False, indent=4)
+    return promptLength // 4 + maxTokensPerExpression * expressions
+
+
+def fits_budget(expression, tokenBudget, maxTokensPerExpression=220):
+    """ Whether a prompt for expression alone (and its answer) fits in tokenBudget tokens """
+
+    # create_prompt lists every expression on its own line, after a fixed header and footer
+    return estimate_tokens(len(create_prompt([])) + len(expression) + 1, 1, maxTokensPerExpression) <= tokenBudget
+
+
+def make_batches(items, batchSize, tokenBudget, needsPrompt, maxTokensPerExpression=220, maxItems=100):
+    """ Groups (expression, value) items into batches holding at most batchSize expressions that
+    need a prompt, starting a new batch early when a prompt and its answer wouldn't fit in
+    tokenBudget tokens. Items that don't need a prompt go along in the current batch, up to maxItems
+    items per batch. Yields the batches as they fill up, so items can be streamed """
+
+    baseLength = len(create_prompt([]))
+    batch, expressions, promptLength = list(), 0, baseLength
+    for expression, value in items:
+        sendExpression = needsPrompt(expression, value)
+        if sendExpression and not fits_budget(expression, tokenBudget, maxTokensPerExpression):
+            print(f"Skipping {expression}: its prompt alone is over the budget of {tokenBudget} tokens")
+            sendExpression = False
+
+        if batch and (
+            len(batch) >= maxItems
+            or sendExpression
+            and (
+                expressions >= batchSize
+                or estimate_tokens(promptLength + len(expression) + 1, expressions + 1, maxTokensPerExpression) > tokenBudget
+            )
+        ):
+            yield batch
+            batch, expressions, promptLength = list(), 0, baseLength
+        batch.append((expression, value))
+        if sendExpression:
+            expressions += 1
+            promptLength += len(expression) + 1
+
+    if batch:
+        yield batch
+
+
+def generate_prompts(batch, limiter, tokenLimiter, maxTokensPerExpression=220):
+    """ Asks the model for sentences for a batch of expressions in a single prompt.
+    Returns the parsed JSON answer, keyed by expression """
+
+    # create_prompt lists every expression of the batch in the same prompt
+    prompt = create_prompt(batch)
+    maxTokens = maxTokensPerExpression * len(batch)
+
+    # Stay under the tokens per minute budget; make_batches() keeps every batch within it
+    limiter.acquire()
+    tokenLimiter.acquire(estimate_tokens(len(prompt), len(batch), maxTokensPerExpression))
+
+    chat_completion = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}], max_tokens=maxTokens, temperature=0.8).choices[0].message.content
+    print(chat_completion)
+    return json.loads(chat_completion)
+
+
+def process_expressions(batchSize=1, workers=1, requestsPerMinute=60, tokensPerMinute=60000):
+    """ Generates sentences and explanations for every expression not generated yet.
+    Packs batchSize expressions per prompt and runs up to workers prompts concurrently,
+    under requestsPerMinute and tokensPerMinute budgets.
+
+    Expressions are streamed from frequency_marked_wikt_filtered.json and written back in order
+    (see stream_update()); generated prompts are appended to generated_prompts.json.journal, and
+    merged into generated_prompts.json at the end. Only the keys of generated prompts are kept in memory """
+
+    expressionsPath = 'frequency_marked_wikt_filtered.json'
+    promptsPath = "generated_prompts.json"
+    promptsJournalPath = f"{promptsPath}.journal"
+
+    # Expressions whose prompt was generated by a previous run, including interrupted ones
+    generatedKeys = {key for key, _ in iter_json_lines(promptsJournalPath)}
+    if os.path.exists(promptsPath):
+        generatedKeys.update(key for key, _ in iter_json_object(promptsPath))
+
+    # Skip expressions already generated or whose key exists in the generated_prompts
+    def needs_prompt(expression, value):
+        return not (("generated" in value and value["generated"]) or expression in generatedKeys)
+
+    limiter = TokenBucket.per_minute(requestsPerMinute, burst=workers)
+    tokenLimiter = TokenBucket(tokensPerMinute / 60, capacity=tokensPerMinute)
+
+    def generate_batch(batch):
+        # A batch over the tokens per minute budget could never be sent: make_batches() leaves those out
+        expressions = [
+            expression
+            for expression, value in batch
+            if needs_prompt(expression, value) and fits_budget(expression, tokensPerMinute)
+        ]
+        generated = {}
+        if expressions:
+            try:
+                generated = generate_prompts(expressions, limiter, tokenLimiter)
+            except Exception as e:
+                print(f"Failed to generate prompt for {expressions} due to {str(e)}")
+
+        # Split the answer back per expression; missing ones are retried on the next run
+        values = list()
+        for expression, value in batch:
+            if expression in expressions:
+                value = dict(value)
+                if isinstance(generated, dict) and expression in generated:
+                    generatedPrompts.append(expression, generated[expression])
+                    value["generated"] = True
+                    print(f"Generated prompt for {expression}")
+                else:
+                    if generated:
+                        print(f"Failed to generate prompt for {expression}: missing from the answer")
+                    value["generated"] = False
+            values.append(value)
+        return values
+
+    generatedPrompts = JSONLinesJournal(promptsJournalPath)
+    try:
+        stream_update(
+            expressionsPath,
+            expressionsPath,
+            generate_batch,
+            batches=lambda items: make_batches(items, batchSize, tokensPerMinute, needs_prompt),
+            workers=workers,
+            window=2 * workers,
+        )
+    finally:
+        # Save the generated prompts to generated_prompts.json
+        generatedPrompts.close()
+        merge_json_lines(promptsPath, promptsJournalPath)
 
 
 def csv_to_json():
-    results = {}
+    """ Adds every crawled phrase missing from all_phrases.json to it. The file is streamed:
+    existing entries are copied one by one, and only the phrases themselves are kept in memory """
 
-    # If the all_phrases.json file does not exist or is empty, initialize an empty dictionary
-    if not os.path.exists("all_phrases.json") or os.path.getsize("all_phrases.json") == 0:
-        results = {}
-    else:
-        with open("all_phrases.json", "r", encoding='utf8') as file:
-            results = json.load(file)
-
-    # Iterate over all csv files
-    for csv_file in glob.glob("crawled/csv/*.csv"):
-        with open(csv_file, newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip the header
-            for row in reader:
-                phrase = row[0]
-                # Only process phrases that haven't been processed yet
-                if phrase not in results:
-                    # Set frequency as None as placeholder. Replace it with the actual function to calculate frequency if available.
-                    # Set present_in_wiktionnaire as None as placeholder. Replace it with the actual function to check presence in Wiktionary if available.
-                    results[phrase] = {"frequency": None, "present_in_wiktionnaire": None}
+    seen = set()
 
     # Save results after processing all phrases
-    with open("all_phrases.json", "w", encoding='utf8') as file:
-        json.dump(results, file, ensure_ascii=False)
-
-def process_phrases():
-    results = {}
-    # If the frequency.json file does not exist or is empty, initialize an empty dictionary
-    if not os.path.exists("frequency.json") or os.path.getsize("frequency.json") == 0:
-        results = {}
-    else:
-        with open("frequency.json", "r", encoding='utf8') as file:
-            results = json.load(file)
-
-    # iterate over all csv files
-    for csv_file in glob.glob("crawled/csv/*.csv"):
-        with open(csv_file, newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip the header
-            for row in reader:
-                phrase = row[0]
-                # only process phrases that haven't been processed yet
-                if phrase not in results:
-                    # wait 3 seconds to avoid getting blocked by Google (429 error)
-                    time.sleep(3)
-                    results[phrase] = get_total_results(phrase)
-                    # save results after processing each phrase
-                    with open("frequency.json", "w", encoding='utf8') as file:
-                        json.dump(results, file, ensure_ascii=False)
+    with JSONObjectWriter("all_phrases.json") as output:
+        # Copy the phrases of a previous run, if the all_phrases.json file exists
+        if os.path.exists("all_phrases.json"):
+            for phrase, value in iter_json_object("all_phrases.json"):
+                seen.add(phrase)
+                output.write(phrase, value)
+
+        # Iterate over all csv files
+        for csv_file in glob.glob("crawled/csv/*.csv"):
+            with open(csv_file, newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip the header
+                for row in reader:
+                    phrase = row[0]
+                    # Only process phrases that haven't been processed yet
+                    if phrase not in seen:
+                        seen.add(phrase)
+                        # Set frequency as None as placeholder. Replace it with the actual function to calculate frequency if available.
+                        # Set present_in_wiktionnaire as None as placeholder. Replace it with the actual function to check presence in Wiktionary if available.
+                        output.write(phrase, {"frequency": None, "present_in_wiktionnaire": None})
+
+def process_phrases(queriesPerMinute=100, checkpointEvery=25, maxConsecutiveFailures=10):
+    """ Queries the number of Google results for every crawled phrase, saving them to frequency.json.
+    Requests are paced by a token bucket sized from the API quota (queriesPerMinute), which slows
+    down and retries on 429/5xx. Results are checkpointed every checkpointEvery phrases, and
+    a new run resumes from the last checkpoint """
+
+    # Resume from frequency.json and the checkpoints journaled after it
+    results = JournaledJSON("frequency.json", batchSize=checkpointEvery, compactEvery=1000, indent=None)
+    limiter = AdaptiveTokenBucket(queriesPerMinute / 60)
+    consecutiveFailures = 0
+
+    try:
+        # iterate over all csv files
+        for csv_file in glob.glob("crawled/csv/*.csv"):
+            with open(csv_file, newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip the header
+                for row in reader:
+                    phrase = row[0]
+                    # only process phrases that haven't been processed yet
+                    if phrase in results:
+                        continue
+
+                    try:
+                        totalResults = call_with_retries(
+                            functools.partial(get_total_results, phrase),
+                            limiter,
+                            lambda e: isinstance(e, CustomSearchError) and e.retryable,
+                        )
+                    except CustomSearchError as e:
+                        # Leave the phrase out of the results so the next run retries it
+                        print(f"Skipping '{phrase}': {e}")
+                        consecutiveFailures += 1
+                        if consecutiveFailures >= maxConsecutiveFailures:
+                            print("Too many consecutive failures (quota exhausted?). Stopping.")
+                            return
+                        continue
+
+                    consecutiveFailures = 0
+                    results.set(phrase, totalResults)
+    finally:
+        # Save every result obtained so far, even if the run was interrupted
+        results.close()
+
+
+def process_phrases_offline(ngramIndexPath):
+    """ Same as process_phrases, but counts every crawled phrase in a local n-gram index
+    (see ngram_index.py) instead of querying Google, in a single bulk lookup """
+
+    results = JournaledJSON("frequency.json", batchSize=1000, compactEvery=100000, indent=None)
+    try:
+        phrases = list()
+        for csv_file in glob.glob("crawled/csv/*.csv"):
+            with open(csv_file, newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip the header
+                phrases.extend(row[0] for row in reader if row[0] not in results)
+
+        with NgramIndex(ngramIndexPath) as index:
+            counts = index.counts(phrases)
+
+        tooLong = 0
+        for phrase, count in counts.items():
+            # Phrases longer than the index's n-grams can't be counted; leave them out
+            if count is None:
+                tooLong += 1
+                continue
+            results.set(phrase, count)
+        print(f"Counted {len(counts) - tooLong} phrases ({tooLong} longer than {index.maxN} words skipped).")
+    finally:
+        results.close()
 
 
 if __name__ == "__main__":
@@ -242,6 +438,8 @@ if __name__ == "__main__":
     # print(prompt)
 
     process_expressions()
+    # Pack 5 expressions per prompt and run 4 prompts at a time
+    # process_expressions(batchSize=5, workers=4)
     # csv_to_json()
 
 
@@ -254,6 +452,8 @@ if __name__ == "__main__":
 
     # Process all phrases
     # process_phrases()
+    # Or count them offline, in a local n-gram index built with ngram_index.py
+    # process_phrases_offline("ngrams.idx")
     # sort_json_file("frequency.json")
 
 
@@ -281,6 +481,12 @@ if __name__ == "__main__":
 #     # scrap_pages_multithread("urls_to_scrape'_example.'txt", audiosPath, targetLanguage)
 #     # print("Done scraping URLs from .txt file.")
 
+#     # Scrap pages listed in .txt file one by one, generating audios on 8 worker threads
+#     # scrap_pages_pipelined("urls_to_scrape_example.txt", audiosPath, targetLanguage, ttsWorkers=8)
+
+#     # Scrap pages listed in .txt file with asyncio (hundreds of pages in flight)
+#     # scrap_pages_async("urls_to_scrape_example.txt", audiosPath, targetLanguage, maxConcurrency=200)
+
 #     # Examples: (remove the # to uncomment)
 #     # Scrap one by one from .txt file
 #     # with open("urls_to_scrape_example.txt", encoding="utf-8") as file:
@@ -1,53 +1,53 @@
+import os
 import re
+import sys
+import html
 
-def format_target_language_sentence(targetLanguageSentence):
-    """ Cleans and formats a scraped targetLanguageSentence. Returns the new sentence """
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.formatting import Formatter, sub, replace, strip, STRONG_TO_BOLD_UNDERLINE, ADD_FULL_STOP_IGNORING_WHITESPACE
 
-    # Replace <em> tags with bold and underline
-    targetLanguageSentence = re.sub(r"<em>\s*", "<b><u>", targetLanguageSentence)
-    targetLanguageSentence = re.sub(
-        r"(\W*)\s*<\/em>", r"</u></b>\1", targetLanguageSentence
-    )
+# Any HTML tag, as left by the formatting functions (<b>, <u>...)
+TAG_REGEX = re.compile(r"<[^>]*>")
 
+# Rules for scraped targetLanguage sentences
+TARGET_LANGUAGE_FORMATTER = Formatter(
+    # Replace <em> tags with bold and underline
+    sub(r"<em>\s*", "<b><u>"),
+    sub(r"(\W*)\s*<\/em>", r"</u></b>\1"),
     # Remove extra whitespace
-    targetLanguageSentence = targetLanguageSentence.replace("  ", " ")
+    replace("  ", " "),
+    ADD_FULL_STOP_IGNORING_WHITESPACE,
+    strip(),
+)
+
+# Rules for scraped nativeLanguage sentences
+NATIVE_LANGUAGE_FORMATTER = Formatter(
+    # Remove <a> tags and extra whitespace
+    sub(r"\s\s+", " "),
+    sub("""<a class="link_highlighted".*<em>""", "<b><u>"),
+    replace("</a>", ""),
+    STRONG_TO_BOLD_UNDERLINE,
+    ADD_FULL_STOP_IGNORING_WHITESPACE,
+    strip(),
+)
 
-    # Add full stop if necessary
-    targetLanguageSentence = re.sub(r"(\w+)\s*\Z", r"\1.", targetLanguageSentence)
-    targetLanguageSentence = re.sub(
-        r"(<\/u><\/b>)\s*\Z", r"\1.", targetLanguageSentence
-    )
 
-    return targetLanguageSentence.strip()
+def format_target_language_sentence(targetLanguageSentence):
+    """ Cleans and formats a scraped targetLanguageSentence. Returns the new sentence """
+
+    return TARGET_LANGUAGE_FORMATTER.format(targetLanguageSentence)
 
 
 def format_native_language_sentence(nativeLanguageSentence):
     """ Cleans and formats a scraped nativeLanguageSentence. Returns the new sentence """
 
-    # Remove <a> tags and extra whitespace
-    nativeLanguageSentence = re.sub(r"\s\s+", " ", nativeLanguageSentence)
-    nativeLanguageSentence = re.sub(
-        """<a class="link_highlighted".*<em>""", "<b><u>", nativeLanguageSentence
-    )
-    nativeLanguageSentence = nativeLanguageSentence.replace("</a>", "")
-    # nativeLanguageSentence = nativeLanguageSentence.replace("</em>", "</u></b>")
-
-    # Replace <strong> tags with bold and underline
-    nativeLanguageSentence = re.sub(r"<strong>\s*", "<b><u>", nativeLanguageSentence)
-    nativeLanguageSentence = re.sub(
-        r"(\W*)\s*<\/strong>", r"</u></b>\1", nativeLanguageSentence
-    )
-    nativeLanguageSentence = re.sub(
-        r"(<\/u><\/b>)(\w+)", r"\1 \2", nativeLanguageSentence
-    )
-
-    # Adds full stop if necessary
-    nativeLanguageSentence = re.sub(r"(\w+)\s*\Z", r"\1.", nativeLanguageSentence)
-    nativeLanguageSentence = re.sub(
-        r"(<\/u><\/b>)\s*\Z", r"\1.", nativeLanguageSentence
-    )
-
-    return nativeLanguageSentence.strip()
+    return NATIVE_LANGUAGE_FORMATTER.format(nativeLanguageSentence)
+
+def strip_markup(sentence):
+    """ Removes tags and unescapes entities from a formatted sentence, without parsing it into a tree """
+
+    return html.unescape(TAG_REGEX.sub("", sentence))
 
 def create_prompt(phrases):
     # Start of the prompt
@@ -1,14 +1,89 @@
+import os
+import sys
 import json
+import heapq
+import tempfile
+import itertools
 
-def sort_json_file(filename):
-    # Load the data from the JSON file into a dictionary
-    with open(filename, 'r', encoding='utf8') as file:
-        data = json.load(file)
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.json_stream import iter_json_object, JSONObjectWriter
 
-    # Sort the dictionary by value and convert it back into a dictionary
-    sorted_data = dict(sorted(data.items(), key=lambda item: int(item[1]), reverse=False))
 
-    # Write the sorted data to a new JSON file
+def frequency_of(value):
+    """ Returns an expression's frequency as an int, whether the file stores it directly
+    (frequency.json) or in a "frequency" field (all_phrases.json...). None if it is unknown """
+
+    if isinstance(value, dict):
+        value = value.get("frequency")
+    if value is None:
+        return None
+    return int(value)
+
+
+def _ranked_items(filename):
+    """ Yields (frequency, key, value) for every expression of a JSON file with a known frequency """
+
+    for key, value in iter_json_object(filename):
+        frequency = frequency_of(value)
+        if frequency is not None:
+            yield frequency, key, value
+
+
+def top_n(filename, n, largest=True):
+    """ Returns the n most (or, with largest=False, least) frequent expressions of a JSON file,
+    as (key, value) pairs. The file is streamed and only n expressions are kept in memory """
+
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return [(key, value) for _, key, value in select(n, _ranked_items(filename), key=lambda item: item[0])]
+
+
+def _write_run(directory, items):
+    """ Writes sorted (frequency, key, value) items to a temporary JSON lines file. Returns its path """
+
+    with tempfile.NamedTemporaryFile("w", encoding="utf8", dir=directory, suffix=".jsonl", delete=False) as run:
+        for item in items:
+            run.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return run.name
+
+
+def _read_run(path):
+    with open(path, "r", encoding="utf8") as run:
+        for line in run:
+            yield json.loads(line)
+
+
+def sort_json_file(filename, reverse=False, maxItemsInMemory=500_000):
+    """ Writes the expressions of a JSON file sorted by frequency to <filename>_sorted.json.
+
+    Expressions are streamed in chunks of maxItemsInMemory, each chunk is sorted and written to
+    a temporary run, and runs are merged into the output; files larger than memory can be sorted.
+    Equal frequencies keep the order they had in the file, and expressions without a known
+    frequency are written last.
+    """
+
     sorted_filename = filename.replace('.json', '_sorted.json')
-    with open(sorted_filename, 'w', encoding='utf8') as file:
-        json.dump(sorted_data, file, ensure_ascii=False, indent=4)
+    frequencyKey = lambda item: item[0]
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(filename))) as runsDirectory:
+        runPaths = list()
+        items = _ranked_items(filename)
+        while True:
+            chunk = list(itertools.islice(items, maxItemsInMemory))
+            if not chunk:
+                break
+            chunk.sort(key=frequencyKey, reverse=reverse)
+            runPaths.append(_write_run(runsDirectory, chunk))
+            del chunk
+
+        with JSONObjectWriter(sorted_filename) as output:
+            merged = heapq.merge(*map(_read_run, runPaths), key=frequencyKey, reverse=reverse)
+            for _, key, value in merged:
+                output.write(key, value)
+
+            # Expressions without a known frequency go last, in file order
+            for key, value in iter_json_object(filename):
+                if frequency_of(value) is None:
+                    output.write(key, value)
+
+    print(f"Sorted {output.written} expressions into {sorted_filename}.")
@@ -1,23 +1,248 @@
 import os
+import sys
+import json
+import time
 import random
+import shutil
+import hashlib
+import threading
 from google.cloud import texttospeech
 
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import metrics
+# File naming is shared with code that doesn't depend on the TTS client, like the benchmarks
+from common.audio_format import AUDIO_EXTENSIONS, AUDIO_ENCODING, AUDIO_EXTENSION, get_modified_path, audio_filename
+
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/home/atilioa/Documents/AnkiCards/web-scraping-for-sentence-mining/reverso_scraping/api_key.json"
 
 
-# Select the type of audio file
-audio_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.LINEAR16
-)
+def make_audio_config(encoding="MP3", sampleRate=None):
+    """ Builds the AudioConfig for one of AUDIO_EXTENSIONS' encodings. sampleRate (in Hz) resamples
+    the voice's natural rate; lower rates make smaller files, at the cost of some quality """
+
+    if encoding not in AUDIO_EXTENSIONS:
+        raise ValueError(f"Unsupported audio encoding {encoding}, expected one of {', '.join(AUDIO_EXTENSIONS)}.")
+
+    options = {"audio_encoding": getattr(texttospeech.AudioEncoding, encoding)}
+    if sampleRate:
+        options["sample_rate_hertz"] = sampleRate
+    return texttospeech.AudioConfig(**options)
+
+
+# Select the type of audio file: AUDIO_ENCODING at the voice's natural rate unless set otherwise
+audio_config = make_audio_config(AUDIO_ENCODING, int(os.getenv("WAVENET_SAMPLE_RATE", 0)))
 
 # Instantiates a client
 client = texttospeech.TextToSpeechClient()
 
+# On-disk snapshot of the voice catalog, so list_voices() is called at most once per TTL
+VOICES_SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "voices_snapshot.json"
+)
+VOICES_SNAPSHOT_TTL = 7 * 24 * 60 * 60  # One week, in seconds
+
+# In-process index of voice names keyed by language code
+_voicesByLanguage = None
+_voicesLock = threading.Lock()
+
+
+
+class AudioCache:
+    """ Persistent, content-addressed cache of synthesized audios.
+
+    Entries are keyed by a hash of the text, voice, language and AudioConfig, so the same
+    sentence is only synthesized once, no matter which script or run asks for it.
+    Least recently used entries are evicted once the cache grows over maxBytes.
+    """
+
+    def __init__(self, cacheDir, maxBytes):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cacheDir, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(cacheDir))
+
+    @staticmethod
+    def make_key(text, voiceName, language, audioConfig):
+        """ Returns the hash used as the cache key for a synthesis request """
+
+        config = type(audioConfig).to_json(audioConfig, sort_keys=True)
+        payload = json.dumps([text, voiceName, language, config], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cacheDir, f"{key}.audio")
+
+    def fetch(self, key, destination):
+        """ Links (or copies) the cached audio to destination. Returns False on a miss """
+
+        entryPath = self._entry_path(key)
+        # Link to a temporary name and rename it over destination: destination may itself be a
+        # link to another entry, which must not be written into
+        temporaryPath = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Mark the entry as recently used
+            os.utime(entryPath)
+            try:
+                os.link(entryPath, temporaryPath)
+            except FileNotFoundError:
+                raise
+            except OSError:  # Different filesystem or no hard link support
+                shutil.copyfile(entryPath, temporaryPath)
+        except FileNotFoundError:  # Not cached, or evicted by another process meanwhile
+            with self._lock:
+                self.misses += 1
+            return False
+        os.replace(temporaryPath, destination)
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, audioContent):
+        """ Saves synthesized audio bytes under key, evicting old entries if needed """
+
+        entryPath = self._entry_path(key)
+        # Write to a temporary file first so other processes never see partial entries
+        temporaryPath = f"{entryPath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaryPath, "wb") as out:
+            out.write(audioContent)
+        try:
+            # Overwriting an entry only changes the size by the difference
+            previousSize = os.path.getsize(entryPath)
+        except FileNotFoundError:
+            previousSize = 0
+        os.replace(temporaryPath, entryPath)
+
+        with self._lock:
+            self._size += len(audioContent) - previousSize
+            if self._size > self.maxBytes:
+                self._evict()
+
+    def _evict(self):
+        """ Removes least recently used entries until the cache is 10% under maxBytes """
+
+        entries = sorted(
+            (entry for entry in os.scandir(self.cacheDir) if entry.name.endswith(".audio")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= self.maxBytes * 0.9:
+                break
+            try:
+                entrySize = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:  # Already evicted by another process
+                continue
+            self._size -= entrySize
+            self.evictions += 1
+
+    def stats(self):
+        """ Returns the cache's hit/miss/eviction counters and current size """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._size,
+            }
+
+
+# Audio cache shared by every script generating audios with this module
+audio_cache = AudioCache(
+    os.getenv(
+        "WAVENET_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "sentence-mining", "audios"),
+    ),
+    int(os.getenv("WAVENET_CACHE_MAX_BYTES", 5 * 1024 ** 3)),  # 5 GiB by default
+)
+
+
+def _build_voices_index(voices):
+    """ Builds a {language code: [voice names]} index from a list of (name, language codes) pairs """
 
-def get_modified_path(originalPath):
-    """Modifies the sentence's string so it can be used as a path"""
+    voicesByLanguage = dict()
+    for name, languageCodes in voices:
+        for languageCode in languageCodes:
+            voicesByLanguage.setdefault(languageCode, []).append(name)
 
-    return "".join(c for c in originalPath if c.isalpha())
+    return voicesByLanguage
+
+
+def load_voice_catalog(refresh=False):
+    """ Returns the voice catalog index, loading it from the on-disk snapshot when it is fresh enough.
+    Only calls list_voices() if the snapshot is missing, expired or refresh is True """
+
+    global _voicesByLanguage
+
+    with _voicesLock:
+        if _voicesByLanguage is not None and not refresh:
+            return _voicesByLanguage
+
+        voices = None
+        if not refresh and os.path.exists(VOICES_SNAPSHOT_PATH):
+            with open(VOICES_SNAPSHOT_PATH, "r", encoding="utf8") as f:
+                snapshot = json.load(f)
+            if time.time() - snapshot["fetched_at"] < VOICES_SNAPSHOT_TTL:
+                voices = snapshot["voices"]
+
+        if voices is None:
+            print("Fetching WaveNet voice catalog...")
+            voices = [
+                (voice.name, list(voice.language_codes))
+                for voice in client.list_voices().voices
+            ]
+            with open(VOICES_SNAPSHOT_PATH, "w", encoding="utf8") as f:
+                json.dump({"fetched_at": time.time(), "voices": voices}, f)
+
+        _voicesByLanguage = _build_voices_index(voices)
+        return _voicesByLanguage
+
+
+def get_voices(language):
+    """ Returns the names of non-Standard (WaveNet, Neural...) voices available for a language code """
+
+    return [
+        name
+        for name in load_voice_catalog().get(language, [])
+        if "Standard" not in name
+    ]
+
+
+def synthesize_cached(synthesis_input, voice, outputPath):
+    """ Writes the audio for synthesis_input to outputPath, synthesizing it only on a cache miss """
+
+    key = AudioCache.make_key(
+        synthesis_input.text, voice.name, voice.language_code, audio_config
+    )
+    if audio_cache.fetch(key, outputPath):
+        print(f'Audio content reused from cache for "{outputPath}"')
+        metrics.count("tts_cache_hits")
+        return
+
+    # Perform the text-to-speech request on the text input with the selected
+    # voice parameters and audio file type
+    with metrics.stage("tts"):
+        response = client.synthesize_speech(synthesis_input, voice, audio_config)
+    metrics.count("tts_requests")
+    metrics.count("tts_bytes", len(response.audio_content))
+    audio_cache.store(key, response.audio_content)
+
+    # The response's audio_content is binary. Write it to a new file renamed over outputPath:
+    # an existing outputPath may be a hard link to a cache entry, which opening it would overwrite
+    temporaryPath = f"{outputPath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaryPath, "wb") as out:
+        # Write the response to the output audio file
+        out.write(response.audio_content)
+    os.replace(temporaryPath, outputPath)
+    print(f'Audio content written to file "{outputPath}"')
 
 
 def generate_audio(path, sentence, language):
@@ -30,15 +255,7 @@ def generate_audio(path, sentence, language):
         language_code=language, ssml_gender=texttospeech.enums.SsmlVoiceGender.NEUTRAL
     )
 
-    # Perform the text-to-speech request on the text input with the selected
-    # voice parameters and audio file type
-    response = client.synthesize_speech(synthesis_input, voice, audio_config)
-
-    # The response's audio_content is binary.
-    with open(f"{path}{sentence}.mp3", "wb") as out:
-        # Write the response to the output audio file.
-        out.write(response.audio_content)
-        print(f'Audio content written to file "{path}{sentence}.mp3"')
+    synthesize_cached(synthesis_input, voice, f"{path}{sentence}.{AUDIO_EXTENSION}")
 
 
 def generate_audio_random(path, sentence, language):
@@ -47,15 +264,11 @@ def generate_audio_random(path, sentence, language):
     # Set the text input to be synthesized
     synthesis_input = texttospeech.types.SynthesisInput(text=sentence)
 
-    voices = client.list_voices()
-    selectedVoices = [
-        voice.name
-        for voice in voices.voices
-        if (language in voice.language_codes or language in voice.language_codes)
-        and "Standard" not in voice.name
-    ]
+    # Pick a voice from the cached catalog instead of calling list_voices() every time.
+    # Seeding with the sentence keeps the voice stable across runs, so the audio cache can hit
+    selectedVoices = sorted(get_voices(language))
     # print(selectedVoices)
-    selectedVoice = random.choice(selectedVoices)
+    selectedVoice = random.Random(sentence).choice(selectedVoices)
 
     # Build the voice request, select the language code and the ssml
     # voice gender ("neutral")
@@ -68,17 +281,7 @@ def generate_audio_random(path, sentence, language):
         ssml_gender=texttospeech.enums.SsmlVoiceGender.SSML_VOICE_GENDER_UNSPECIFIED,
     )
 
-    # Perform the text-to-speech request on the text input with the selected
-    # voice parameters and audio file type
-    response = client.synthesize_speech(synthesis_input, voice, audio_config)
-
-    # The response's audio_content is binary
-    with open(f"{path}{get_modified_path(sentence)}.mp3", "wb") as out:
-        # Write the response to the output audio file
-        out.write(response.audio_content)
-        print(
-            f'Audio content written to file "{path}{get_modified_path(sentence)}.mp3"'
-        )
+    synthesize_cached(synthesis_input, voice, f"{path}{audio_filename(sentence)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+""" Runs a source's whole workflow (crawl → scrape → TTS/download → export) as one streaming pipeline.
+
+Stages run at the same time and are connected by bounded queues: pages are fetched on a thread
+pool, parsed on a process pool, voiced on a rate-limited thread pool and exported as soon as they
+are ready. Blog posts go through the same fetch → parse → download → export steps, their audios
+being downloaded instead of voiced. Usage:
+
+    python run_pipeline.py reverso --crawl-index p --language fr-FR
+    python run_pipeline.py reverso --urls urls_to_scrape.txt --language fr-FR
+    python run_pipeline.py frances_fluente --crawl
+    python run_pipeline.py influx --urls scrap_influx.txt
+    python run_pipeline.py mairo_vergara --urls posts.txt
+"""
+
+import os
+import sys
+import logging
+import argparse
+import functools
+import importlib.util
+import urllib.parse
+from multiprocessing import cpu_count
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(ROOT, "reverso_scraping"))
+from common.pipeline import Pipeline
+from common.http_cache import cached_get
+from common.export import get_sink, merge_shards
+from common.dedup import claim_sentence, claim_cards, release_sentences
+from common.rate_limit import TokenBucket
+
+# Each blog scraper's script, and the separator of its export shards
+BLOG_SOURCES = {
+    "influx": ("influx_scraping/scrap.py", "\t"),
+    "frances_fluente": ("frances_fluente_scraping/scrap.py", "|"),
+    "mairo_vergara": ("mairo_vergara_scraping/scrap.py", "^"),
+}
+
+
+def read_urls(path):
+    """ Yields the non-empty lines of a .txt file of URLs """
+
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield line.strip()
+
+
+# Reverso stages. Parsing runs in worker processes, so its function must be at module level
+
+
+def crawl_reverso_ranking(rankingURL):
+    """ Crawls a Reverso ranking page, writing its subranking CSV. Returns the URLs of its words """
+
+    from crawl import HEADERS, parse_top, write_subranking_csv
+
+    req = cached_get(rankingURL, headers=HEADERS)
+    if req.status_code != 200:
+        print(f"Failed GET request for {rankingURL}.")
+        return None
+
+    names = parse_top(rankingURL, req.content, onlyNames=True, ranking=False)
+    write_subranking_csv(rankingURL, names)
+    return [
+        f"https://context.reverso.net/traducao/frances-portugues/{urllib.parse.quote(name)}"
+        for name in names
+    ]
+
+
+def fetch_reverso_page(targetURL):
+    from crawl import HEADERS
+
+    req = cached_get(targetURL, headers=HEADERS)
+    if req.status_code != 200:
+        print(f"Failed GET request for {targetURL}.")
+        return None
+    return [req.content]
+
+
+def parse_reverso_page(content, targetLanguage):
+    from page_parser import parse_page_cards
+
+    return parse_page_cards(content, targetLanguage)
+
+
+def run_reverso(args):
+    from crawl import crawl_top
+    from str_utils import strip_markup
+    from wavenet import generate_audio_random, audio_filename, load_voice_catalog
+
+    os.makedirs("crawled/csv", exist_ok=True)
+    os.makedirs(args.audios, exist_ok=True)
+    # Make sure the voice catalog snapshot exists so TTS workers don't all call list_voices() at once
+    load_voice_catalog()
+
+    sink = get_sink("csv", "reverso", "\t")
+    limiter = TokenBucket.per_minute(args.requests_per_minute, burst=args.tts_workers)
+
+    def voice_card(card):
+        targetSentence, nativeSentence = card
+        # Skip sentences already kept from another page, source or run
+        if not claim_sentence(targetSentence, "reverso"):
+            return None
+
+        cleanSentence = strip_markup(targetSentence)
+        try:
+            limiter.acquire()
+            generate_audio_random(args.audios, cleanSentence, args.language)
+        except BaseException:
+            # The card won't be exported: let a later run claim its sentence again
+            release_sentences([targetSentence])
+            raise
+        return [[targetSentence, nativeSentence, f"[sound:{audio_filename(cleanSentence)}]", "targetLanguage_reverso"]]
+
+    def export_card(row):
+        sink.write_cards([row])
+
+    pipeline = Pipeline(maxQueued=args.max_queued)
+    if args.crawl_index:
+        # Stream word URLs from the ranking pages as they are crawled
+        source = crawl_top(
+            f"https://context.reverso.net/traducao/index/frances-portugues/{args.crawl_index}.html", ranking=True
+        ) or []
+        pipeline.add_stage("crawl", crawl_reverso_ranking, workers=2)
+    else:
+        source = read_urls(args.urls)
+
+    pipeline.add_stage("fetch", fetch_reverso_page, workers=args.fetch_workers)
+    pipeline.add_stage(
+        "parse",
+        functools.partial(parse_reverso_page, targetLanguage=args.language),
+        workers=args.parse_workers,
+        processes=True,
+    )
+    pipeline.add_stage("tts", voice_card, workers=args.tts_workers)
+    pipeline.add_stage("export", export_card, workers=1)
+    pipeline.run(source)
+
+    sink.flush()
+    merge_shards("csv", "reverso")
+
+
+def load_scraper(name, relativePath):
+    """ Imports a scraper's script under a unique module name (they are all called scrap.py) """
+
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relativePath))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_blog(args):
+    relativePath, separator = BLOG_SOURCES[args.source]
+    scraper = load_scraper(f"{args.source}_scrap", relativePath)
+    os.makedirs("audios", exist_ok=True)
+
+    if args.source == "mairo_vergara":
+        # Log failed parsings to failed.log, as the script does
+        scraper.failedLogger.addHandler(logging.FileHandler("failed.log"))
+    if args.source == "frances_fluente" and args.crawl:
+        scraper.crawl_page("https://francesfluente.com")
+
+    # The scraper's own steps (what its post function runs one after the other), with a post's cards
+    # going through each stage together so its audios are still downloaded in parallel
+    def fetch_post(url):
+        content = scraper.fetch_post(url)
+        return None if content is None else [(url, content)]
+
+    def parse_post(post):
+        cards = scraper.parse_post(*post)
+        return [cards] if cards else None
+
+    def download_audios(cards):
+        # Skip sentences already kept from another post, source or run
+        cards = claim_cards(cards, args.source)
+        try:
+            return [scraper.download_audios(cards)]
+        except BaseException:
+            # The cards won't be exported: let a later run claim their sentences again
+            release_sentences(card[0] for card in cards)
+            raise
+
+    def export_cards(cards):
+        try:
+            scraper.export_cards(cards)
+        except BaseException:
+            release_sentences(card[0] for card in cards)
+            raise
+
+    pipeline = Pipeline(maxQueued=args.max_queued)
+    pipeline.add_stage("fetch", fetch_post, workers=args.fetch_workers)
+    # The scrapers are loaded from their files, so they can't be imported by a process pool
+    pipeline.add_stage("parse", parse_post, workers=args.parse_workers)
+    pipeline.add_stage("download", download_audios, workers=args.download_workers)
+    pipeline.add_stage("export", export_cards, workers=1)
+    pipeline.run(read_urls(args.urls))
+
+    scraper.get_sink("csv", args.source, separator).flush()
+    merge_shards("csv", args.source, separator=separator)
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a scraper's whole workflow as a streaming pipeline")
+    parser.add_argument("--max-queued", type=int, default=64, help="items waiting between two stages")
+    sources = parser.add_subparsers(dest="source", required=True)
+
+    reverso = sources.add_parser("reverso", help="crawl → fetch → parse → TTS → export Reverso pages")
+    urls = reverso.add_mutually_exclusive_group(required=True)
+    urls.add_argument("--urls", help=".txt file with the pages to scrape, one per line")
+    urls.add_argument("--crawl-index", help="letter index to crawl for words (e.g. p)")
+    reverso.add_argument("--language", default="fr-FR", help="target language code, for TTS")
+    reverso.add_argument("--audios", default="audios/", help="where generated audios are written")
+    reverso.add_argument("--fetch-workers", type=int, default=16)
+    reverso.add_argument("--parse-workers", type=int, default=cpu_count())
+    reverso.add_argument("--tts-workers", type=int, default=8)
+    reverso.add_argument("--requests-per-minute", type=int, default=500, help="TTS requests budget")
+    reverso.set_defaults(run=run_reverso)
+
+    for source, defaultURLs in (
+        ("influx", "scrap_influx.txt"),
+        ("frances_fluente", "posts_urls.txt"),
+        ("mairo_vergara", "posts.txt"),
+    ):
+        blog = sources.add_parser(source, help="fetch → parse → download audios → export posts")
+        blog.add_argument("--urls", default=defaultURLs, help=".txt file with the posts to scrape")
+        blog.add_argument("--fetch-workers", type=int, default=8, help="posts fetched at the same time")
+        blog.add_argument("--parse-workers", type=int, default=2)
+        blog.add_argument("--download-workers", type=int, default=4, help="posts whose audios are downloaded at the same time")
+        if source == "frances_fluente":
+            blog.add_argument("--crawl", action="store_true", help="crawl posts_urls.txt first")
+        blog.set_defaults(run=run_blog)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import signal
+import subprocess
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a child process: journals `entries`, starts writing a last one and is killed mid-write
+KILLED_RUN = textwrap.dedent(
+    """
+    import os, sys, json, signal
+    sys.path.append({root!r})
+    from common.json_journal import JournaledJSON
+
+    store = JournaledJSON({path!r}, batchSize=1, compactEvery=1000)
+    for key, value in {entries!r}:
+        store.set(key, value)
+
+    # Half of the next entry reaches the journal before the process dies
+    with open(store.journalPath, "a", encoding="utf8") as journal:
+        journal.write(json.dumps(["killed", 0])[:7])
+    os.kill(os.getpid(), signal.SIGKILL)
+    """
+)
+
+
+def killed_run(path, entries):
+    script = KILLED_RUN.format(root=ROOT, path=path, entries=entries)
+    result = subprocess.run([sys.executable, "-c", script])
+    assert result.returncode == -signal.SIGKILL
+
+
+def test_resumes_after_killed_runs(tmp_path):
+    path = str(tmp_path / "store.json")
+    sys.path.append(ROOT)
+    from common.json_journal import JournaledJSON
+
+    killed_run(path, [("a", 1), ("b", 2), ("c", 3)])
+    # Resumes once, then is killed again mid-write
+    killed_run(path, [("d", 4), ("e", 5)])
+
+    store = JournaledJSON(path)
+    assert store.data == {"a": 1, "b": 2, "c": 3, "d": 4, "e": 5}
+    with open(store.journalPath, encoding="utf8") as journal:
+        assert [json.loads(line) for line in journal] == [["a", 1], ["b", 2], ["c", 3], ["d", 4], ["e", 5]]
+
+    store.set("f", 6)
+    store.close()
+    with open(path, encoding="utf8") as f:
+        assert json.load(f) == {"a": 1, "b": 2, "c": 3, "d": 4, "e": 5, "f": 6}
+    assert not os.path.exists(store.journalPath)
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+
+from common.json_stream import iter_json_object, JSONObjectWriter, stream_update
+
+DOCUMENT = {
+    "a": 12.5,
+    "b": 1e5,
+    "c": -0.25e-3,
+    "avoir la flemme": {"frequency": 123456, "present_in_wiktionnaire": True, "ratio": 3.14159},
+    "être \"dans\" le pétrin": [None, False, [], {}, "x, y: }"],
+    "d": 7,
+}
+
+
+def test_every_chunk_size(tmp_path):
+    path = tmp_path / "document.json"
+    for indent in (None, 4):
+        text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+        path.write_text(text, encoding="utf8")
+        for chunkSize in range(1, len(text) + 1):
+            assert list(iter_json_object(path, chunkSize)) == list(DOCUMENT.items()), (indent, chunkSize)
+
+
+def test_writer_round_trip(tmp_path):
+    path = tmp_path / "document.json"
+    with JSONObjectWriter(str(path)) as output:
+        output.write_all(DOCUMENT.items())
+
+    assert json.loads(path.read_text(encoding="utf8")) == DOCUMENT
+    for chunkSize in (1, 2, 3, 7, 1 << 20):
+        assert dict(iter_json_object(path, chunkSize)) == DOCUMENT
+
+
+def test_stream_update_resumes_in_order(tmp_path):
+    path = str(tmp_path / "numbers.json")
+    with JSONObjectWriter(path) as output:
+        output.write_all((f"n{i}", i) for i in range(100))
+
+    def failing_square(batch):
+        if any(key == "n60" for key, _ in batch):
+            raise RuntimeError("interrupted")
+        return [value * value for _, value in batch]
+
+    with pytest.raises(RuntimeError):
+        stream_update(path, path, failing_square, workers=4, window=8)
+    # The source is only replaced once every item is done
+    assert dict(iter_json_object(path)) == {f"n{i}": i for i in range(100)}
+
+    updated = list()
+
+    def square(batch):
+        updated.extend(key for key, _ in batch)
+        return [value * value for _, value in batch]
+
+    stream_update(path, path, square, workers=4, window=8)
+    assert list(iter_json_object(path)) == [(f"n{i}", i * i) for i in range(100)]
+    # Items done before the interruption were not updated again
+    assert "n0" not in updated and "n60" in updated
+    assert not os.path.exists(f"{path}.progress")
@@ -1,11 +1,12 @@
+import os
+import sys
 import urllib
 import requests
-import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
 
-# Lock for safely writing to the file from multiple threads
-lock = threading.Lock()
+# Shared helpers live in common/, at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.json_stream import stream_update
+from common.metrics import metrics
 
 def check_expression(expression, value):
     # If this expression has already been checked, return it as is
@@ -15,7 +16,9 @@ def check_expression(expression, value):
     # Create the URL for the expression
     url = "https://fr.wiktionary.org/wiki/" + urllib.parse.quote(expression)
 
-    response = requests.get(url)
+    with metrics.stage("check_expression"):
+        response = requests.get(url)
+    metrics.count("fetch_bytes", len(response.content))
 
     # If the status code of the response is 200, the page exists
     if response.status_code == 200:
@@ -26,47 +29,27 @@ def check_expression(expression, value):
 
     return expression, value
 
-def save_expression(expression, value):
-    with lock:
-        # Load the current data
-        with open('frequency_marked.json', 'r', encoding='utf8') as f:
-            data = json.load(f)
+def mark_expression(items):
+    """ Checks a single expression, as a stream_update() batch. Returns its updated value """
 
-        # Update the expression's data
-        data[expression] = value
+    (expression, value), = items
+    # Initialize expressions with None for 'present_in_wiktionnaire'
+    if type(value) is str:
+        value = {"frequency": value, "present_in_wiktionnaire": None}
 
-        # Save back to the file
-        with open('frequency_marked.json', 'w', encoding='utf8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-
-def mark_expressions():
     try:
-        # Try to load the marked expressions from a previous run
-        with open('frequency_marked.json', 'r', encoding='utf8') as f:
-            expressions = json.load(f)
-            for expression, value in expressions.items():
-                if type(value) is str:
-                    expressions[expression] = {"frequency": expressions[expression], "present_in_wiktionnaire": None}
-    except FileNotFoundError:
-        # If the file doesn't exist, load the unmarked expressions
-        with open('all_phrases.json', 'r', encoding='utf8') as f:
-            expressions = json.load(f)
-            # Initialize all expressions with None for 'present_in_wiktionnaire'
-            for expression in expressions.keys():
-                if type(expressions[expression]) is str:
-                    expressions[expression] = {"frequency": expressions[expression], "present_in_wiktionnaire": None}
-
-    # Create a ThreadPoolExecutor
-    with ThreadPoolExecutor() as executor:
-        # Start the load operations and mark each future with its URL
-        future_to_url = {executor.submit(check_expression, expression, value): expression for expression, value in expressions.items()}
-
-        for future in as_completed(future_to_url):
-            expression = future_to_url[future]
-            try:
-                expression, value = future.result()
-                save_expression(expression, value)
-            except Exception as exc:
-                print('%r generated an exception: %s' % (expression, exc))
+        # Expressions checked in a previous run are returned as they are
+        return [check_expression(expression, value)[1]]
+    except Exception as exc:
+        print('%r generated an exception: %s' % (expression, exc))
+        return [value]
+
+def mark_expressions(workers=16):
+    # Re-check the marked expressions of a previous run if there is one, otherwise mark the unmarked expressions
+    source = 'frequency_marked.json' if os.path.exists('frequency_marked.json') else 'all_phrases.json'
+
+    # Expressions are streamed from the source and written back in order to frequency_marked.json, in the
+    # format process_expressions expects; frequency_marked.json.progress lets an interrupted run resume
+    stream_update(source, 'frequency_marked.json', mark_expression, workers=workers, window=4 * workers)
 
 mark_expressions()